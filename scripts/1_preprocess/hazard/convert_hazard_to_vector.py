@@ -1,41 +1,60 @@
 """Threshold hazard data and convert to vector polygons
 
-The key command that defines the threshold is an option to gdal_calc::
+Each hazard raster is read once, and polygons of the cells where::
 
-    --calc=logical_and(A>={}, A<999)
+    threshold <= value < 999
 
-To run with GNU Parallel::
-    seq 0.5 0.5 5 | parallel ./convert_hazard_to_vector.py {}
-    seq 6 1 15 | parallel ./convert_hazard_to_vector.py {}
+are written for every threshold (as with ``gdal_calc.py`` then
+``gdal_polygonize.py``), in EPSG:4326, to
+data/tanzania_flood/threshold_{threshold}/. Hazard layers are run over a
+process pool of at most `MAX_PROCESSES` workers, each holding one raster's
+threshold levels in memory.
 
-Likely to be difficult to run on Windows unless gdal_calc.py and
-gdal_polygonize.py are set up as executables and on the user's PATH
+To run for all thresholds, or a subset::
+    python convert_hazard_to_vector.py
+    python convert_hazard_to_vector.py 0.5 1.0
 """
-import subprocess
+import os
+import shutil
 import sys
+from multiprocessing import Pool
 
-def main(threshold):
-    """Clean output folder, run conversion
-    """
-    print("Processing", threshold)
-    subprocess.run(["rm", "-rf", "data/tanzania_flood/threshold_{}".format(threshold)])
-    subprocess.run(["mkdir", "data/tanzania_flood/threshold_{}".format(threshold)])
-    for arg_set in generate_args(threshold):
-        convert(threshold=threshold, **arg_set)
+import fiona
+from fiona.crs import from_epsg
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..', '..'))
+from scripts.raster import threshold_levels, threshold_shapes
+
+# named as by `seq 0.5 0.5 5` and `seq 6 1 15`
+THRESHOLDS = ['{:.1f}'.format(0.5 * i) for i in range(1, 11)] + [str(i) for i in range(6, 16)]
+# bounds memory use, as every worker holds a whole raster's levels
+MAX_PROCESSES = 4
 
-def generate_args(threshold):
+
+def main(thresholds):
+    """Clean output folders, run conversion
+    """
+    print("Processing", ", ".join(thresholds))
+    for threshold in thresholds:
+        threshold_dir = "data/tanzania_flood/threshold_{}".format(threshold)
+        shutil.rmtree(threshold_dir, ignore_errors=True)
+        os.makedirs(threshold_dir)
+
+    arg_sets = [dict(thresholds=thresholds, **arg_set) for arg_set in generate_args()]
+    with Pool(min(MAX_PROCESSES, os.cpu_count() or 1)) as pool:
+        for name in pool.imap_unordered(convert, arg_sets):
+            print("Done", name)
+
+def generate_args():
     """Generate file arguments for convert function
     """
     # EUWATCH
     return_periods = ['00005', '00025', '00050', '00100', '00250', '00500', '01000']
 
     for return_period in return_periods:
-        print("EUWATCH", return_period, threshold)
         yield {
             'infile': "data/tanzania_flood/EUWATCH/inun_dynRout_RP_{}_Tanzania/inun_dynRout_RP_{}_contour_Tanzania.tif".format(return_period, return_period),
-            'tmpfile_1': "data/tanzania_flood/EUWATCH_{}_mask-{}.tif".format(return_period, threshold),
-            'tmpfile_2': "data/tanzania_flood/EUWATCH_{}_vector_mask-{}.shp".format(return_period, threshold),
-            'outfile': "data/tanzania_flood/threshold_{}/EUWATCH_{}_mask-{}.shp".format(threshold, return_period, threshold)
+            'name': "EUWATCH_{}".format(return_period)
         }
 
     # GLOFRIS models
@@ -43,12 +62,9 @@ def generate_args(threshold):
 
     for model in models:
         for return_period in return_periods:
-            print(model, return_period, threshold)
             yield {
                 'infile': "data/tanzania_flood/{}/rcp6p0/2030-2069/inun_dynRout_RP_{}_bias_corr_masked_Tanzania/inun_dynRout_RP_{}_bias_corr_contour_Tanzania.tif".format(model, return_period, return_period),
-                'tmpfile_1': "data/tanzania_flood/{}_{}_mask-{}.tif".format(model, return_period, threshold),
-                'tmpfile_2': "data/tanzania_flood/{}_{}_vector_mask-{}.shp".format(model, return_period, threshold),
-                'outfile': "data/tanzania_flood/threshold_{}/{}_{}_mask-{}.shp".format(threshold, model, return_period, threshold)
+                'name': "{}_{}".format(model, return_period)
             }
 
     # Convert SSBN models
@@ -60,53 +76,29 @@ def generate_args(threshold):
 
     for model, abbr in ssbnmodels.items():
         for return_period in ssbn_return_periods:
-            print("SSBN", abbr, return_period, threshold)
             yield {
                 'infile': "data/tanzania_flood/SSBN_flood_data/{}/TZ-{}-{}-1.tif".format(model, abbr, return_period),
-                'tmpfile_1': "data/tanzania_flood/SSBN_{}_{}_mask-{}.tif".format(abbr, return_period, threshold),
-                'tmpfile_2': "data/tanzania_flood/SSBN_{}_{}_vector_mask-{}.shp".format(abbr, return_period, threshold),
-                'outfile': "data/tanzania_flood/threshold_{}/SSBN_{}_{}_mask-{}.shp".format(threshold, abbr, return_period, threshold)
+                'name': "SSBN_{}_{}".format(abbr, return_period)
             }
 
-def convert(threshold, infile, tmpfile_1, tmpfile_2, outfile):
-    """Threshold raster, convert to polygons, assign crs
+def convert(arg_set):
+    """Threshold raster, convert to polygons, assign crs, for each threshold
     """
-    args = [
-        "gdal_calc.py",
-        '-A', infile,
-        '--outfile={}'.format(tmpfile_1),
-        '--calc=logical_and(A>={}, A<999)'.format(threshold),
-        '--type=Byte', '--NoDataValue=0',
-        '--co=SPARSE_OK=YES',
-        '--co=NBITS=1',
-        '--quiet'
-        # Could enable compression
-        # --co="COMPRESS=LZW"
-    ]
-    subprocess.run(args)
-
-    subprocess.run([
-        "gdal_polygonize.py",
-        tmpfile_1,
-        '-q',
-        '-f', 'ESRI Shapefile',
-        tmpfile_2
-    ])
-
-    subprocess.run([
-        "ogr2ogr",
-        '-a_srs', 'EPSG:4326',
-        outfile,
-        tmpfile_2
-    ])
-
-    subprocess.run(["rm", tmpfile_1])
-    subprocess.run(["rm", tmpfile_2])
-    subprocess.run(["rm", tmpfile_2.replace('shp', 'shx')])
-    subprocess.run(["rm", tmpfile_2.replace('shp', 'dbf')])
-    subprocess.run(["rm", tmpfile_2.replace('shp', 'prj')])
+    thresholds = arg_set['thresholds']
+    levels, transform, _ = threshold_levels(
+        arg_set['infile'], [float(threshold) for threshold in thresholds])
+
+    schema = {'geometry': 'Polygon', 'properties': {'DN': 'int'}}
+    for level, threshold in enumerate(thresholds):
+        outfile = "data/tanzania_flood/threshold_{}/{}_mask-{}.shp".format(
+            threshold, arg_set['name'], threshold)
+        with fiona.open(outfile, 'w', driver='ESRI Shapefile', crs=from_epsg(4326),
+                        schema=schema) as sink:
+            sink.writerecords(
+                {'geometry': geometry, 'properties': {'DN': 1}}
+                for geometry in threshold_shapes(levels, level, transform))
+    return arg_set['name']
 
 if __name__ == '__main__':
-    if len(sys.argv) != 2:
-        exit("Usage: python convert_hazard_to_vector.py <threshold>")
-    main(sys.argv[1])
+    thresholds = sys.argv[1:] or THRESHOLDS
+    main(sorted(thresholds, key=float))
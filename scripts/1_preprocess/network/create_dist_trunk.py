@@ -10,8 +10,9 @@ import geopandas as gpd
 import os
 import pandas as pd
 from shapely.geometry import Point
-import networkx as nx
-from network_analysis import get_shortest_distance
+from network_analysis import get_trunk_distances
+from scripts.network import read_network
+from scripts.raster import raster_points
 import numpy as np
 
 if __name__ == "__main__":
@@ -23,36 +24,22 @@ if __name__ == "__main__":
 
     '''Set file in and output names'''
     shape_in = curdir+"\\regions\\"+region+'.shp'
-    raster_out = curdir+"\\%s-globpop.tif" % region
     raster_in = 'F:\Dropbox\Oxford\Tanzania\TZA_Roads\GLOBPOP\TZA_popmap15adj_v2b.tif'
-    outCSVName = 'points_%s_in.csv' % region
-
-    '''Clip to region and convert to points'''
-    os.system('gdalwarp -cutline '+shape_in+' -crop_to_cutline -dstalpha '+raster_in+' '+raster_out)
-    os.system('gdal2xyz.py -skip 3 -csv '+raster_out+' '+ outCSVName)
-
-    '''Load points and convert to geodataframe with coordinates'''    
-    load_points = pd.read_csv(outCSVName,header=None,names=['x','y','pop_dens'],index_col=None)
-    load_points = load_points[load_points['pop_dens'] > 5] 
- 
-    geometry = [Point(xy) for xy in zip(load_points.x, load_points.y)]
-    load_points = load_points.drop(['x', 'y'], axis=1)
-    crs = {'init': 'epsg:4326'}
-    points_gdp = gpd.GeoDataFrame(load_points, crs=crs, geometry=geometry)
-    del load_points
 
-    ''' Load local road network of the pre-defined region'''
-    g = nx.read_shp("cleaned_regions//%s-highway-1.shp" % region)
+    '''Read populated cells within region as points'''
+    region_shape = gpd.read_file(shape_in).unary_union
+    xs, ys, pop_dens = raster_points(raster_in, region_shape, threshold=5, skip=3)
 
-    g_undir = nx.connected_component_subgraphs(g.to_undirected())
-    lengths = [len(x) for x in list(g_undir)]
-    
-    sg =  max(nx.connected_component_subgraphs(g.to_undirected()), key=len)
-    pos = {k: v for k,v in enumerate(sg.nodes())}
+    crs = {'init': 'epsg:4326'}
+    points_gdp = gpd.GeoDataFrame({'pop_dens': pop_dens}, crs=crs,
+                                  geometry=[Point(xy) for xy in zip(xs, ys)])
 
-    nodes = np.array(sg.nodes())
+    ''' Load local road network of the pre-defined region'''
+    net = read_network("cleaned_regions//%s-highway-1.shp" % region)
+    trunk_distances = get_trunk_distances(net)
 
-    points_gdp['dist_trunk'] = points_gdp['geometry'].apply(lambda x: get_shortest_distance(sg,nodes,x)) 
+    point_nodes, _ = net.snap(xs, ys)
+    points_gdp['dist_trunk'] = trunk_distances[point_nodes]
     points_gdp.to_file(driver = 'ESRI Shapefile', filename= "dist_trunk_%s.shp" % region)             
         
 
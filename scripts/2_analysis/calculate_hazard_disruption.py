@@ -0,0 +1,86 @@
+"""Calculate road network disruption for each hazard layer
+
+Reads the exposure table written by
+generate_scenarios/intersect_networks_with_raster.py and, for every
+(model, return period, flood depth threshold), removes the exposed road
+links from the compiled network and reroutes the routes between the ends
+of each link which used them. Writes one summary row per hazard layer and
+threshold.
+"""
+# pylint: disable=C0103
+import csv
+import os
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+from scripts.disruption import (evaluate_scenarios, hazard_scenarios, od_routes,
+                                save_routes, summarise_reroute)
+from scripts.exposure import read_exposure
+from scripts.network import network_cache_path, read_network
+from scripts.utils import load_config
+
+# flood depths (m) above which a road link is taken to be impassable
+THRESHOLDS = (0, 0.5, 1.0, 2.0)
+
+
+def main():
+    config = load_config()
+    data_path = config['data_path']
+    road_filename = os.path.join(
+        data_path, 'Infrastructure', 'Roads', 'road_shapefiles', 'tanroads_main_all_2017_adj.shp')
+    exposure_filename = os.path.join(
+        data_path, 'analysis', 'network_intersections.parquet')
+    output_filename = os.path.join(
+        data_path, 'analysis', 'road_hazard_disruption.csv')
+
+    attributes = ('link',)
+    net = read_network(road_filename, attributes=attributes)
+    network_cache = network_cache_path(road_filename, attributes=attributes)
+
+    exposure = read_exposure(
+        exposure_filename,
+        columns=['network_element', 'id', 'model', 'return_period', 'flood_depth'],
+        sectors=['road'])
+    exposure = exposure[exposure['network_element'] == 'edge']
+    scenarios = hazard_scenarios(net, exposure, 'link', THRESHOLDS)
+
+    # routes between the ends of each link, once per pair of nodes
+    od_pairs = np.unique(np.sort(net.edge_nodes, axis=1), axis=0)
+    routes = od_routes(net, od_pairs[:, 0], od_pairs[:, 1])
+    routes_cache = tempfile.mkdtemp()
+    save_routes(routes, os.path.join(routes_cache, 'routes'))
+
+    try:
+        with open(output_filename, 'w', newline='') as output_fh:
+            writer = csv.writer(output_fh)
+            writer.writerow([
+                'model', 'return_period', 'threshold', 'n_exposed',
+                'n_routes', 'n_disconn', 'incr_fact', 'incr_km'
+            ])
+            results = evaluate_scenarios(
+                network_cache, os.path.join(routes_cache, 'routes'),
+                [failed_edges for _, failed_edges in scenarios])
+            for i, ods, new_dist in results:
+                (model, return_period, threshold), failed_edges = scenarios[i]
+                n_routes, n_disconn, incr_fact, incr_km = summarise_reroute(
+                    routes, ods, new_dist)
+                writer.writerow([
+                    model,
+                    return_period,
+                    threshold,
+                    len(failed_edges),
+                    n_routes,
+                    n_disconn,
+                    "{:.4f}".format(incr_fact),
+                    "{:.3f}".format(incr_km)
+                ])
+    finally:
+        shutil.rmtree(routes_cache)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""Calculate single point of failure (local failure) criticality of road and
+rail links
+
+For each link, the route between the two ends of every link is rerouted
+around it, and the largest route length increase is written out as
+`incr_fact`, in percent of the original route length (100 * (new - old) /
+old, as binned by the criticality maps), with `n_disconn` the number of
+those routes which can no longer be made at all. Links which disconnect
+any route get an `incr_fact` of `DISCONNECTED_INCR_FACT`, above the top
+(single point of failure) class of the criticality maps.
+"""
+# pylint: disable=C0103
+import os
+import sys
+
+from collections import defaultdict
+
+import fiona
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+from scripts.disruption import edge_failure_factors
+from scripts.network import read_network
+from scripts.utils import load_config
+
+# increase (percent) written for links whose failure disconnects a route
+DISCONNECTED_INCR_FACT = 1e6
+
+
+def main():
+    config = load_config()
+    inf_path = os.path.join(config['data_path'], 'Infrastructure')
+    output_path = os.path.join(
+        config['data_path'], 'Analysis_results', 'spof_localfailure_results')
+    os.makedirs(output_path, exist_ok=True)
+
+    networks = [
+        (
+            os.path.join(inf_path, 'Roads', 'road_shapefiles', 'tanroads_main_all_2017_adj.shp'),
+            'link',
+            os.path.join(output_path, 'tz_road_spof_geom.shp')
+        ),
+        (
+            os.path.join(inf_path, 'Railways', 'railway_shapefiles', 'tanzania-rail-ways-processed.shp'),
+            'id',
+            os.path.join(output_path, 'tz_rail_spof_geom.shp')
+        )
+    ]
+    for network_path, id_key, spof_path in networks:
+        print(network_path)
+        incr_fact, disconnected = link_criticality(network_path, id_key)
+        write_criticality(network_path, id_key, spof_path, incr_fact, disconnected)
+
+
+def link_criticality(network_path, id_key):
+    """Local failure criticality of each link, as dicts of link id =>
+    percent increase in route length and link id => number of
+    disconnected routes
+    """
+    net = read_network(network_path, attributes=(id_key,))
+
+    # routes between the ends of each link, once per pair of nodes
+    od_pairs = np.unique(np.sort(net.edge_nodes, axis=1), axis=0)
+    edge_incr_fact, edge_disconnected = edge_failure_factors(
+        net, od_pairs[:, 0], od_pairs[:, 1])
+
+    incr_fact = defaultdict(float)
+    disconnected = defaultdict(int)
+    for link, edge_fact, edge_disconn in zip(
+            net.attributes[id_key].tolist(), edge_incr_fact.tolist(),
+            edge_disconnected.tolist()):
+        incr_fact[link] = max(incr_fact[link], 100 * edge_fact)
+        disconnected[link] = max(disconnected[link], edge_disconn)
+    return incr_fact, disconnected
+
+
+def write_criticality(network_path, id_key, spof_path, incr_fact, disconnected):
+    """Write link geometries with incr_fact and n_disconn, with incr_fact
+    set to `DISCONNECTED_INCR_FACT` where n_disconn > 0
+    """
+    with fiona.open(network_path) as network:
+        schema = {
+            'geometry': network.schema['geometry'],
+            'properties': {
+                id_key: network.schema['properties'][id_key],
+                'incr_fact': 'float',
+                'n_disconn': 'int'
+            }
+        }
+        with fiona.open(spof_path, 'w', driver='ESRI Shapefile', crs=network.crs,
+                        schema=schema) as sink:
+            for record in network:
+                link = record['properties'][id_key]
+                if link not in incr_fact:
+                    # not part of the routable network
+                    continue
+                if disconnected[link]:
+                    link_incr_fact = DISCONNECTED_INCR_FACT
+                else:
+                    link_incr_fact = incr_fact[link]
+                sink.write({
+                    'geometry': record['geometry'],
+                    'properties': {
+                        id_key: link,
+                        'incr_fact': link_incr_fact,
+                        'n_disconn': disconnected[link]
+                    }
+                })
+
+
+if __name__ == '__main__':
+    main()
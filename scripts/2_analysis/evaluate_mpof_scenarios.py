@@ -0,0 +1,85 @@
+"""Evaluate multiple point of failure scenarios over the road network
+
+Reads scenarios as rows of `scenario,links` where links is a JSON list of
+TANROADS link ids failing together, e.g.:
+
+    A,"[1994, 6870, 6855]"
+
+For each scenario, the routes between the ends of every link which use a
+failed link are rerouted, and a summary row is written as each scenario
+finishes.
+"""
+# pylint: disable=C0103
+import csv
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+from collections import defaultdict
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+from scripts.disruption import evaluate_scenarios, od_routes, save_routes, summarise_reroute
+from scripts.network import network_cache_path, read_network
+from scripts.utils import load_config
+
+
+def main():
+    config = load_config()
+    data_path = config['data_path']
+    road_filename = os.path.join(
+        data_path, 'Infrastructure', 'Roads', 'road_shapefiles', 'tanroads_main_all_2017_adj.shp')
+    scenarios_filename = os.path.join(
+        data_path, 'Analysis_results', 'mpof_scenarios.csv')
+    output_filename = os.path.join(
+        data_path, 'Analysis_results', 'mpof_scenario_results.csv')
+
+    # compile (or read the cached) network, which workers memory-map
+    attributes = ('link',)
+    net = read_network(road_filename, attributes=attributes)
+    network_cache = network_cache_path(road_filename, attributes=attributes)
+
+    edges_by_link = defaultdict(list)
+    for edge, link in enumerate(net.attributes['link'].tolist()):
+        edges_by_link[link].append(edge)
+
+    names = []
+    scenarios = []
+    with open(scenarios_filename, 'r') as fh:
+        for line in csv.DictReader(fh):
+            names.append(line['scenario'])
+            scenarios.append([
+                edge for link in json.loads(line['links']) for edge in edges_by_link[link]
+            ])
+
+    # routes between the ends of each link, once per pair of nodes
+    od_pairs = np.unique(np.sort(net.edge_nodes, axis=1), axis=0)
+    routes = od_routes(net, od_pairs[:, 0], od_pairs[:, 1])
+    routes_cache = tempfile.mkdtemp()
+    save_routes(routes, os.path.join(routes_cache, 'routes'))
+
+    try:
+        with open(output_filename, 'w', newline='') as output_fh:
+            writer = csv.writer(output_fh)
+            writer.writerow(['scenario', 'n_routes', 'n_disconn', 'incr_fact', 'incr_km'])
+            results = evaluate_scenarios(
+                network_cache, os.path.join(routes_cache, 'routes'), scenarios)
+            for i, ods, new_dist in results:
+                n_routes, n_disconn, incr_fact, incr_km = summarise_reroute(
+                    routes, ods, new_dist)
+                writer.writerow([
+                    names[i],
+                    n_routes,
+                    n_disconn,
+                    "{:.4f}".format(incr_fact),
+                    "{:.3f}".format(incr_km)
+                ])
+    finally:
+        shutil.rmtree(routes_cache)
+
+
+if __name__ == '__main__':
+    main()
@@ -8,63 +8,23 @@ Output rows like:
 - rp
 - point_val
 """
-import csv
 import os
 import sys
 
-import fiona
-from rasterstats import zonal_stats
-
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..', '..'))
+from scripts.intersection import intersect_networks
 from scripts.utils import *
 
 
 def main():
     config = load_config()
     out_path = os.path.join(
-        config['data_path'], 'analysis', 'network_intersections.csv'
+        config['data_path'], 'analysis', 'network_intersections.parquet'
     )
-    with open(out_path, 'w', newline='') as out_fh:
-        writer = csv.writer(out_fh)
-        writer.writerow([
-            'network_element',
-            'sector',
-            'id',
-            'model',
-            'return_period',
-            'flood_depth'
-        ])
-        for network_details in get_network_details():
-            with fiona.open(network_details['path']) as network:
-                for hazard_details in get_hazard_details():
-                    intersect_network(network, network_details, hazard_details, writer)
-
-def intersect_network(network, network_details, hazard_details, writer):
-    sector = network_details['sector']
-    node_or_edge = network_details['node_or_edge']
-    id_key = get_id_key_for_sector(sector)
-
-    hazard_path = hazard_details['path']
-    model = hazard_details['model']
-    rp = hazard_details['r_period']
-
-    for record in network:
-        print(record)
-        break
-
-    all_stats = zonal_stats(network, hazard_path, stats=['max'])
-
-    for stats, element in zip(all_stats, network):
-        if stats['max'] is not None and stats['max'] > 0 and stats['max'] < 999:
-            el_id = element['properties'][id_key]
-            writer.writerow([
-                node_or_edge,
-                sector,
-                str(el_id),
-                model,
-                str(int(rp)),
-                str(stats['max'])
-            ])
+    network_details = get_network_details()
+    for network in network_details:
+        network['id_key'] = get_id_key_for_sector(network['sector'])
+    intersect_networks(network_details, get_hazard_details(), out_path)
 
 def get_network_details():
     config = load_config()
@@ -8,55 +8,20 @@ Output rows like:
 - rp
 - point_val
 """
-import csv
 import os
 import sys
 
-import fiona
-from rasterstats import zonal_stats
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..', '..'))
+from scripts.intersection import intersect_networks
 
-def main(filenum):
-    # all output printed to STDOUT - start with CSV header
-    with open('osm_intersection_{}.csv'.format(filenum), 'w') as fh:
-        w = csv.writer(fh)
-        w.writerow((
-            'network_element',
-            'sector',
-            'id',
-            'model',
-            'return_period',
-            'flood_depth'
-        ))
-        for network_details in get_network_details(filenum):
-            with fiona.open(network_details['path']) as network:
-                for hazard_details in get_hazard_details():
-                    for line in intersect_network(network, network_details, hazard_details):
-                        w.writerow(line)
 
-def intersect_network(network, network_details, hazard_details):
-    sector = network_details['sector']
-    node_or_edge = network_details['node_or_edge']
+def main():
+    # TZA.shp is split into chunks of 20,000 features, run over a process
+    # pool; rerunning after an interruption skips completed chunks
+    intersect_networks(
+        get_network_details(), get_hazard_details(), 'osm_intersections.parquet')
 
-    hazard_path = hazard_details['path']
-    model = hazard_details['model']
-    return_period = hazard_details['r_period']
-
-    all_stats = zonal_stats(network, hazard_path, stats=['max'])
-
-    for stats, element in zip(all_stats, network):
-        max_ = stats['max']
-        if max_ is not None and max_ > 0 and max_ < 999:
-            yield (
-                node_or_edge,
-                sector,
-                str(element['properties']['id']),
-                model,
-                str(int(return_period)),
-                str(max_),
-                element['properties']['highway']
-            )
-
-def get_network_details(filenum):
+def get_network_details():
     base_path = os.path.join(
         os.path.dirname(__file__),
         '..', '..', '..', 'data', 'Infrastructure'
@@ -69,7 +34,9 @@ def get_network_details(filenum):
                 base_path,
                 'Roads',
                 'osm_mainroads',
-                'TZA.shp.{}.shp'.format(filenum)),
+                'TZA.shp'),
+            'id_key': 'id',
+            'properties': [('osm_highway', 'highway')]
         }
     ]
 
@@ -160,5 +127,4 @@ def get_hazard_details():
     return details
 
 if __name__ == '__main__':
-    print("Running", sys.argv[1])
-    main(sys.argv[1])
+    main()
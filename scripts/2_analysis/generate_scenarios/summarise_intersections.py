@@ -1,142 +1,126 @@
 """Summarise intersections with raster
+
+Intersections are summarised as a `scripts.exposure.ExposureMatrix`, a
+binary sparse matrix of (sector, id) assets by (model, return_period,
+bounds) hazard layers, which is saved for the plots to read and written
+out as the wide and sparse CSV tables.
 """
-import csv
 import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..', '..'))
+from scripts.exposure import CURRENT_MODELS, FUTURE_MODELS, exposure_matrix, \
+    read_exposure as read_exposure_table, save_exposure_matrix
+from scripts.utils import load_config
+
+# assets per block of the wide table, bounding memory to block x columns
+BLOCK_SIZE = 50000
 
 
 def main():
+    data_path = load_config()['data_path']
+    output_path = os.path.join(data_path, 'tanzania_flood')
+
     print("Reading exposure")
-    exposure = read_exposure()
+    exposure = read_exposure(
+        os.path.join(data_path, 'analysis', 'network_intersections.parquet'))
     print("Writing exposure")
-    write_exposure_by_model(exposure)
-    write_exposure_sparse(exposure)
+    save_exposure_matrix(
+        exposure, os.path.join(output_path, 'hazard_network_exposure_matrix'))
+    write_exposure_by_model(
+        exposure, os.path.join(output_path, 'hazard_network_exposure.csv'))
+    write_exposure_sparse(
+        exposure, os.path.join(output_path, 'hazard_network_exposure_sparse.csv'))
 
 
-def read_exposure():
+def read_exposure(path):
     """Read intersections produced by `intersect_networks_with_raster.py`
 
     Returns
     -------
-    exposure: dict of dict
-        keys are tuple(sector, id) and values are dicts to lookup exposure
-        with keys tuple(model, return_period, (lower, upper)) and values bool
+    exposure: scripts.exposure.ExposureMatrix
+        exposure of each (sector, id) to each (model, return_period, bounds),
+        with bands indexing `get_bounds()`
     """
-    path = os.path.join(
-        os.path.dirname(__file__), '..', 'data', 'tanzania_flood', 'hazard_network_intersections.csv'
-    )
-    # header = [
-    #     'network_element',
-    #     'sector',
-    #     'id',
-    #     'model',
-    #     'return_period',
-    #     'flood_depth'
-    # ]
-    exposure = {}
-    with open(path, 'r') as fh:
-        r = csv.DictReader(fh)
-        for line in r:
-            asset_key = (line['sector'], line['id'])
-
-            if asset_key not in exposure:
-                exposure[asset_key] = {}
-
-            bounds = get_bounds_for_val(float(line['flood_depth']))
-            hazard_key = (line['model'], int(line['return_period']), bounds)
-
-            exposure[asset_key][hazard_key] = True
-
-    return exposure
-
-
-def write_exposure_by_model(exposure):
+    table = read_exposure_table(
+        path, columns=['sector', 'id', 'model', 'return_period', 'flood_depth'])
+    return exposure_matrix(table, get_bounds())
+
+
+def write_exposure_by_model(exposure, path):
     """Write fat table, one row per exposed asset, columns for model/rp/bound
     """
-    path = os.path.join(
-        os.path.dirname(__file__), '..', 'data', 'tanzania_flood', 'hazard_network_exposure.csv'
-    )
-    header = ['sector', 'id'] + [key for key, tup in get_model_rp_bounds()]
-    with open(path, 'w', newline='') as fh:
-        w = csv.DictWriter(fh, fieldnames=header)
-        w.writeheader()
-        for (sector, asset_id), asset_exposure in exposure.items():
-            out = {
-                'sector': sector,
-                'id': asset_id
-            }
-            for key_string, model_rp_bounds in get_model_rp_bounds():
-                if model_rp_bounds in asset_exposure:
-                    out[key_string] = 1
-                else:
-                    out[key_string] = 0
-            w.writerow(out)
-
-
-def write_exposure_sparse(exposure):
+    model_rp_bounds = get_model_rp_bounds()
+    header = ['sector', 'id'] + [key for key, tup in model_rp_bounds]
+    column_lookup = {tup: i for i, (key, tup) in enumerate(model_rp_bounds)}
+
+    # column of each hazard layer, -1 where it has none
+    layer_columns = np.array(
+        [column_lookup.get(key, -1) for key in _layer_keys(exposure)], dtype=np.int64)
+    n_columns = len(model_rp_bounds)
+
+    prefixes = np.char.add(
+        np.char.add(exposure.sectors, ','), np.char.add(exposure.ids, ',')).astype(bytes)
+    with open(path, 'wb') as fh:
+        fh.write((','.join(header) + '\n').encode())
+        for start in range(0, exposure.n_assets, BLOCK_SIZE):
+            stop = min(start + BLOCK_SIZE, exposure.n_assets)
+            # scatter the block's entries to dense 0/1 digits interleaved
+            # with separators, so each row formats as '0,1,...,0\n'
+            begin, end = exposure.indptr[start], exposure.indptr[stop]
+            rows = np.repeat(np.arange(stop - start), np.diff(exposure.indptr[start:stop + 1]))
+            columns = layer_columns[exposure.indices[begin:end]]
+            matched = columns >= 0
+            chars = np.full((stop - start, 2 * n_columns), ord(','), dtype=np.uint8)
+            chars[:, 0::2] = ord('0')
+            chars[rows[matched], 2 * columns[matched]] = ord('1')
+            chars[:, -1] = ord('\n')
+            lines = chars.view('S{}'.format(chars.shape[1])).ravel()
+            fh.write(b''.join(np.char.add(prefixes[start:stop], lines)))
+
+
+def write_exposure_sparse(exposure, path):
     """Write table, one row per exposed asset, column with list of exposure
     """
-    path = os.path.join(
-        os.path.dirname(__file__), '..', 'data', 'tanzania_flood', 'hazard_network_exposure_sparse.csv'
-    )
-    header = ['sector', 'id', 'exposure', 'rpmin_curr', 'rpmin_fut', 'model_frequency']
-    with open(path, 'w', newline='') as fh:
-        w = csv.DictWriter(fh, fieldnames=header)
-        w.writeheader()
-        for (sector, asset_id), asset_exposure in exposure.items():
-            exp = list(asset_exposure.keys())
-            out = {
-                'sector': sector,
-                'id': asset_id,
-                'rpmin_curr': rpmin_curr(exp),
-                'rpmin_fut': rpmin_fut(exp),
-                'model_frequency': len(exp),
-                'exposure': exp
-            }
-            w.writerow(out)
-
-
-def rpmin_curr(exp):
-    return rpmin(exp, [
-        'EUWATCH',
-        'SSBN_FD',
-        'SSBN_FU',
-        'SSBN_PD',
-        'SSBN_PU',
-        'SSBN_UD',
-        'SSBN_UU'
-    ])
-
-
-def rpmin_fut(exp):
-    return rpmin(exp, [
-        'GFDL-ESM2M',
-        'HadGEM2-ES',
-        'IPSL-CM5A-LR',
-        'MIROC-ESM-CHEM',
-        'NorESM1-M'
-    ])
+    # format each layer once, then concatenate them over each asset's row
+    # of the matrix (every asset has at least one)
+    key_strings = np.array([str(key) + ', ' for key in _layer_keys(exposure)], dtype=object)
+    exp = pd.Series(
+        np.add.reduceat(key_strings[exposure.indices], exposure.indptr[:-1])).str[:-2]
+
+    out = pd.DataFrame({
+        'sector': exposure.sectors,
+        'id': exposure.ids,
+        'exposure': '[' + exp.values + ']',
+        'rpmin_curr': rpmin(exposure, CURRENT_MODELS),
+        'rpmin_fut': rpmin(exposure, FUTURE_MODELS),
+        'model_frequency': exposure.frequency()
+    })
+    out.to_csv(path, index=False)
+
+
+def _layer_keys(exposure):
+    """Hazard layers of the matrix, as tuple(model, return_period, (lower, upper))
+    """
+    bounds = get_bounds()
+    return [
+        (model, return_period, bounds[band] if band >= 0 else None)
+        for model, return_period, band in zip(
+            exposure.models.tolist(), exposure.return_periods.tolist(), exposure.bands.tolist())
+    ]
 
 
-def rpmin(exp, models):
-    # exp is list of tuple(model, return_period, (lower, upper))
-    rps = [
-        d[1] for d in exp
-        if d[0] in models
-    ]
-    if len(rps):
-        rp = min(rps)
-    else:
-        rp = None
-    return rp
+def rpmin(exposure, models):
+    """Minimum return period of each asset's exposure to any of models,
+    as a nullable integer column, missing where it has none
+    """
+    rps = pd.array(exposure.min_return_period(models), dtype='Int64')
+    rps[rps == 0] = pd.NA
+    return rps
 
-def get_bounds_for_val(val):
-    bounds = get_bounds()
-    bound = None
-    for lower, upper in bounds:
-        if val > lower and val <= upper:
-            bound = (lower, upper)
-            break
-    return bound
 
 def get_bounds():
     """Single place where series of thresholds 'bounds' are defined
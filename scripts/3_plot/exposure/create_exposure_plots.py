@@ -16,10 +16,10 @@ import cartopy.io.shapereader as shpreader
 import matplotlib.colors
 import matplotlib.patches as mpatches
 import matplotlib.pyplot as plt
-import pandas as pd
 from shapely.geometry import LineString
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..', '..'))
+from scripts.exposure import CURRENT_MODELS, FUTURE_MODELS, load_exposure_matrix
 from scripts.utils import *
 
 def main():
@@ -39,15 +39,20 @@ def main():
         data_path, 'Analysis_results', 'spof_localfailure_results', 'tz_rail_spof_geom.shp')
 
     # Exposure
-    exposure_filename = os.path.join(
-        data_path, 'Analysis_results', 'tz_flood_stats_3.xlsx')
+    exposure = load_exposure_matrix(os.path.join(
+        data_path, 'tanzania_flood', 'hazard_network_exposure_matrix'))
+    exposure_values = {
+        'model_frequency': exposure.frequency(),
+        'rpmin_curr': exposure.min_return_period(CURRENT_MODELS),
+        'rpmin_fut': exposure.min_return_period(FUTURE_MODELS)
+    }
 
     proj_lat_lon = ccrs.PlateCarree()
 
     specs = [
-        # tanroads_link_flooding: link: model_frequency,rpmin_curr,rpmin_fut
+        # road links: link: model_frequency,rpmin_curr,rpmin_fut
         {
-            'sheet_name': 'tanroads_link_flooding',
+            'sector': 'road',
             'shape_filename': road_filename,
             'id_col': 'link',
             'val_col': 'model_frequency',
@@ -56,7 +61,7 @@ def main():
             'title': 'Road link exposure to flooding'
         },
         {
-            'sheet_name': 'tanroads_link_flooding',
+            'sector': 'road',
             'shape_filename': road_filename,
             'id_col': 'link',
             'val_col': 'rpmin_curr',
@@ -65,7 +70,7 @@ def main():
             'title': 'Road minimum current return period exposure'
         },
         {
-            'sheet_name': 'tanroads_link_flooding',
+            'sector': 'road',
             'shape_filename': road_filename,
             'id_col': 'link',
             'val_col': 'rpmin_fut',
@@ -73,9 +78,9 @@ def main():
             'filename': 'exposure_road_links_rpmin_future.png',
             'title': 'Road minimum future return period exposure'
         },
-        # rail_edge_flooding: id: model_frequency,rpmin_curr,rpmin_fut
+        # rail edges: id: model_frequency,rpmin_curr,rpmin_fut
         {
-            'sheet_name': 'rail_edge_flooding',
+            'sector': 'rail',
             'shape_filename': rail_filename,
             'id_col': 'id',
             'val_col': 'model_frequency',
@@ -84,7 +89,7 @@ def main():
             'title': 'Rail link exposure to flooding'
         },
         {
-            'sheet_name': 'rail_edge_flooding',
+            'sector': 'rail',
             'shape_filename': rail_filename,
             'id_col': 'id',
             'val_col': 'rpmin_curr',
@@ -93,7 +98,7 @@ def main():
             'title': 'Rail minimum current return period exposure'
         },
         {
-            'sheet_name': 'rail_edge_flooding',
+            'sector': 'rail',
             'shape_filename': rail_filename,
             'id_col': 'id',
             'val_col': 'rpmin_fut',
@@ -105,28 +110,17 @@ def main():
 
     for spec in specs:
         print(spec['title'])
-        # Read from excel
-        excel_data = pd.read_excel(
-            exposure_filename,
-            sheet_name=spec['sheet_name']
-        )
-        lookup = {}
-        for i, row in excel_data.iterrows():
-            value = row[spec['val_col']]
-            if spec['id_col'] == 'link':
-                id_ = int(row[spec['id_col']])
-            else:
-                id_ = row[spec['id_col']]
-
-            if spec['val_col'] == 'model_frequency':
-                # convert to ratio
-                lookup[id_] = float(value) / 44
-            else:
-                lookup[id_] = value
+        values = exposure_values[spec['val_col']]
+        if spec['val_col'] == 'model_frequency':
+            # convert to ratio
+            values = values / 44
+        asset_rows = exposure.asset_rows(spec['sector'])
 
         data = []
         for record in shpreader.Reader(spec['shape_filename']).records():
-            value = lookup[record.attributes[spec['id_col']]]
+            row = asset_rows.get(str(record.attributes[spec['id_col']]))
+            # assets not exposed to any layer have no row
+            value = values[row] if row is not None else 0
             if spec['val_col'] == 'model_frequency':
                 data.append((record.geometry, value))
             else:
@@ -134,7 +128,7 @@ def main():
                     data.append((record.geometry, value))
 
         ax = get_tz_axes()
-        plot_basemap(ax, data_path)
+        plot_basemap_image(ax, data_path)
 
         if spec['val_col'] == 'model_frequency':
             cmap_name = 'YlOrRd'
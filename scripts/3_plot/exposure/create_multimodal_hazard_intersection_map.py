@@ -149,11 +149,13 @@ with open(airport_filename, 'r') as airports_file:
         )
         ax.imshow(plane_im, origin='upper', extent=img_extent, transform=proj_lat_lon, zorder=5)
 
-data, lat_lon = get_data(hazard_filename)
+data, lat_lon = get_data(hazard_filename, zoom_extent, get_axes_resolution(ax))
 
-# Find global min/max to use for consistent color-mapping
-min_val = np.min(data)
-max_val = np.max(data)
+# Find global min/max to use for consistent color-mapping (overviews keep
+# the maximum of the whole raster)
+overview, _ = get_data(hazard_filename, resolution=get_axes_resolution(ax))
+min_val = np.min(overview)
+max_val = np.max(overview)
 
 colors = plt.get_cmap('Blues')
 # colors.colors[0] = (1, 1, 1, 0)  # set zero values to transparent white - works for e.g. viridis colormap
@@ -15,6 +15,7 @@ import numpy as np
 from shapely.geometry import LineString
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..', '..'))
+from scripts.flow_maps import flow_layer
 from scripts.utils import *
 
 config = load_config()
@@ -55,6 +56,13 @@ nodes = {
 }
 
 # Read outputs
+plots = [
+    ("AADF (thousand tonnes)", "tons"),
+    ("Cost (million USD)", "cost"),
+    ('% of OD flows', "centr"),
+]
+columns = [column for _, column in plots]
+
 scenario_to_suffix = {
     "current": "2016",
     "future": "fut_opt_trend_2030"
@@ -66,25 +74,19 @@ for sector in ["port", "rail", "road"]:
             sector,
             scenario_to_suffix[scenario]
         ))
+        records = list(shpreader.Reader(filename).records())
         if sector == "road":
-            stats[("road_trunk", scenario)] = [
-                record
-                for record in shpreader.Reader(filename).records()
-                if record.attributes['roadclass'] == 'T'
-            ]
-            stats[("road_regional", scenario)] = [
-                record
-                for record in shpreader.Reader(filename).records()
-                if record.attributes['roadclass'] != 'T'
-            ]
+            stats[("road_trunk", scenario)] = flow_layer(
+                (record for record in records if record.attributes['roadclass'] == 'T'),
+                columns
+            )
+            stats[("road_regional", scenario)] = flow_layer(
+                (record for record in records if record.attributes['roadclass'] != 'T'),
+                columns
+            )
         else:
-            stats[(sector, scenario)] = list(shpreader.Reader(filename).records())
+            stats[(sector, scenario)] = flow_layer(records, columns)
 
-plots = [
-    ("AADF (thousand tonnes)", "tons"),
-    ("Cost (million USD)", "cost"),
-    ('% of OD flows', "centr"),
-]
 column_label_divisors = {
     "tons": 1000,
     "cost": 1000000,
@@ -107,7 +109,7 @@ for scenario in ["current_own_range", "current", "future"]:
         for sectors in sector_groups:
             print(scenario, column, sectors)
             ax = get_tz_axes()
-            plot_basemap(ax, data_path)
+            plot_basemap_image(ax, data_path)
             plot_basemap_labels(ax, data_path)
             scale_bar(ax, length=100, location=(0.925,0.02))
 
@@ -115,39 +117,23 @@ for scenario in ["current_own_range", "current", "future"]:
 
             if scenario == "current_own_range":
                 min_weight = round_sf(min(
-                    min(
-                        record.attributes[column]
-                        for record
-                        in stats[(sector, "current")]
-                    )
+                    stats[(sector, "current")].min(column)
                     for sector in sectors
                 ))
                 max_weight = round_sf(max(
-                    max(
-                        record.attributes[column]
-                        for record
-                        in stats[(sector, "current")]
-                    )
+                    stats[(sector, "current")].max(column)
                     for sector in sectors
                 ))
 
             else:
                 # consider both current and future
                 min_weight = round_sf(min(
-                    min(
-                        record.attributes[column]
-                        for record
-                        in stats[(sector, scen)]
-                    )
+                    stats[(sector, scen)].min(column)
                     for sector in sectors
                     for scen in ["current", "future"]
                 ))
                 max_weight = round_sf(max(
-                    max(
-                        record.attributes[column]
-                        for record
-                        in stats[(sector, scen)]
-                    )
+                    stats[(sector, scen)].max(column)
                     for sector in sectors
                     for scen in ["current", "future"]
                 ))
@@ -177,22 +163,14 @@ for scenario in ["current_own_range", "current", "future"]:
                 scenario_key = scenario
 
             for sector in sectors:
-                # assign geoms to weight bins
-                geoms_by_range = {}
-                for value_range in width_by_range:
-                    geoms_by_range[value_range] = []
-
-                for record in stats[(sector, scenario_key)]:
-                    val = record.attributes[column]
-                    geom = record.geometry
-                    for nmin, nmax in geoms_by_range:
-                        if nmin <= val and val < nmax:
-                            geoms_by_range[(nmin, nmax)].append(geom)
+                # assign geoms to weight bins, buffered by bin width
+                geoms_by_range = stats[(sector, scenario_key)].buffered_by_range(
+                    column, width_by_range)
 
                 # plot
-                for range_, width in width_by_range.items():
+                for range_, geoms in geoms_by_range.items():
                     ax.add_geometries(
-                        [geom.buffer(width) for geom in geoms_by_range[range_]],
+                        geoms,
                         crs=proj_lat_lon,
                         edgecolor='none',
                         facecolor=sector_colors[sector],
@@ -60,8 +60,6 @@ fig, axes = plt.subplots(
     figsize=(9, 6),
     dpi=150)
 
-data_with_lat_lon = [get_data(details["filename"]) for details in hazard_file_details]
-
 # Set up colormap and norm
 cmap, norm = get_hazard_cmap_norm()
 
@@ -69,7 +67,7 @@ cmap, norm = get_hazard_cmap_norm()
 zoom_extent = (37.5, 39.5, -8.25, -6.25)
 
 # Plot data to axes
-for (ax_num, ax), (data, lat_lon_extent), details in zip(enumerate(axes.flat), data_with_lat_lon, hazard_file_details):
+for (ax_num, ax), details in zip(enumerate(axes.flat), hazard_file_details):
     ax.locator_params(tight=True)
     ax.outline_patch.set_visible(False)
 
@@ -89,6 +87,8 @@ for (ax_num, ax), (data, lat_lon_extent), details in zip(enumerate(axes.flat), d
     ax.set_extent(zoom_extent, crs=proj)
 
     plot_basemap(ax, data_path)
+    # read only the zoomed area, at about the resolution drawn
+    data, lat_lon_extent = get_data(details["filename"], zoom_extent, get_axes_resolution(ax))
     im = ax.imshow(data, extent=lat_lon_extent, cmap=cmap, norm=norm, zorder=1)
 
 
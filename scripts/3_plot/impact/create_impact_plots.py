@@ -16,6 +16,7 @@ import pandas as pd
 from shapely.geometry import LineString
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..', '..'))
+from scripts.exposure import CURRENT_MODELS, FUTURE_MODELS, load_exposure_matrix
 from scripts.utils import *
 
 def main():
@@ -30,9 +31,14 @@ def main():
     # Rail
     rail_filename = os.path.join(
         data_path, 'Analysis_results', 'spof_localfailure_results', 'tz_rail_spof_geom.shp')
-    # Exposure
-    exposure_filename = os.path.join(
+    # Impacts
+    impact_filename = os.path.join(
         data_path, 'Analysis_results', 'tz_flood_stats_3.xlsx')
+    # Exposure
+    exposure = load_exposure_matrix(os.path.join(
+        data_path, 'tanzania_flood', 'hazard_network_exposure_matrix'))
+    rpmin_currs = exposure.min_return_period(CURRENT_MODELS)
+    rpmin_futs = exposure.min_return_period(FUTURE_MODELS)
 
     x0 = 28.6
     x1 = 41.4
@@ -46,6 +52,7 @@ def main():
         {
             'title': 'Flooding impact on road rerouting',
             'sheet_name': 'tanroads_link_flooding',
+            'sector': 'road',
             'shape_filename': road_filename,
             'id_col': 'link',
             'val_col': 'incr_fact',
@@ -63,6 +70,7 @@ def main():
         {
             'title': 'Flooding impact on road freight',
             'sheet_name': 'tanroads_link_flooding',
+            'sector': 'road',
             'shape_filename': road_filename,
             'id_col': 'link',
             'val_col': 'tr_p_incr_high',
@@ -80,6 +88,7 @@ def main():
         {
             'title': 'Flooding impact on rail freight flows',
             'sheet_name': 'rail_edge_flooding',
+            'sector': 'rail',
             'shape_filename': rail_filename,
             'id_col': 'id',
             'val_col': 'ind_total',
@@ -99,33 +108,37 @@ def main():
         print(spec['title'])
         # Read from excel
         excel_data = pd.read_excel(
-            exposure_filename,
+            impact_filename,
             sheet_name=spec['sheet_name']
         )
         lookup = {}
         for _, row in excel_data.iterrows():
             value = row[spec['val_col']]
-            rpmin_curr = row['rpmin_curr']
-            rpmin_fut = row['rpmin_fut']
 
             if spec['id_col'] == 'link':
                 id_ = int(row[spec['id_col']])
             else:
                 id_ = row[spec['id_col']]
 
-            lookup[id_] = (value, rpmin_curr, rpmin_fut)
+            lookup[id_] = value
+
+        asset_rows = exposure.asset_rows(spec['sector'])
 
         curr = []
         fut = []
         for record in shpreader.Reader(spec['shape_filename']).records():
             id_ = record.attributes[spec['id_col']]
-            value, rpmin_curr, rpmin_fut = lookup[id_]
+            value = lookup[id_]
+            row = asset_rows.get(str(id_))
+            if row is None:
+                # not exposed to any layer
+                continue
 
-            if rpmin_curr > 0:
-                curr.append((record.geometry, value, rpmin_curr))
+            if rpmin_currs[row] > 0:
+                curr.append((record.geometry, value, rpmin_currs[row]))
 
-            if rpmin_fut > 0:
-                fut.append((record.geometry, value, rpmin_fut))
+            if rpmin_futs[row] > 0:
+                fut.append((record.geometry, value, rpmin_futs[row]))
 
         _, axes = plt.subplots(
             nrows=1,
@@ -139,7 +152,7 @@ def main():
             ax.set_extent(tz_extent, crs=proj_lat_lon)
             ax.set_title(subtitle)
 
-            plot_basemap(ax, data_path)
+            plot_basemap_image(ax, data_path)
 
             # Set color_map
             colors = plt.get_cmap('cool')
@@ -85,7 +85,7 @@ for record in shpreader.Reader(rail_filename).records():
 # Create figure for road, just rerouting
 print("figure for road, rerouting")
 ax = get_tz_axes()
-plot_basemap(ax, data_path)
+plot_basemap_image(ax, data_path)
 plot_basemap_labels(ax, data_path)
 scale_bar(ax, length=100, location=(0.925,0.02))
 
@@ -151,7 +151,7 @@ plt.close()
 
 # Create figure for rail, just rerouting
 ax = get_tz_axes()
-plot_basemap(ax, data_path)
+plot_basemap_image(ax, data_path)
 plot_basemap_labels(ax, data_path)
 scale_bar(ax, length=100, location=(0.925, 0.02))
 
@@ -218,7 +218,7 @@ plt.close()
 # Create figure for road, spof
 print("figure for road, spof")
 ax = get_tz_axes()
-plot_basemap(ax, data_path)
+plot_basemap_image(ax, data_path)
 plot_basemap_labels(ax, data_path)
 scale_bar(ax, length=100, location=(0.925,0.02))
 
@@ -285,7 +285,7 @@ plt.close()
 # Create figure for rail, spof
 print("figure for rail, spof")
 ax = get_tz_axes()
-plot_basemap(ax, data_path)
+plot_basemap_image(ax, data_path)
 plot_basemap_labels(ax, data_path)
 scale_bar(ax, length=100, location=(0.925,0.02))
 
@@ -0,0 +1,163 @@
+"""Natural Earth basemap layers around Tanzania
+
+`plot_basemap` and `plot_basemap_labels` (in `scripts.utils`) draw a few
+records from four Natural Earth 10m shapefiles covering the whole world.
+`read_basemap` filters those records once, clips them to a box around
+Tanzania (well beyond any map extent drawn) and caches the geometries on
+disk as WKB, keyed by the shapefile contents. Later calls in the same
+process reuse the layers already loaded.
+"""
+import hashlib
+import os
+
+import cartopy.io.shapereader as shpreader
+import numpy as np
+import shapely.wkb
+from shapely.geometry import box
+
+from scripts.cache import load_arrays, save_arrays, update_shapefile_hash
+
+# Bump when layers or clipping change, to invalidate cached basemaps
+BASEMAP_CACHE_VERSION = 1
+
+# (xmin, ymin, xmax, ymax), padded beyond the Tanzania map extents
+CLIP_BOUNDS = (26.0, -15.5, 44.0, 3.0)
+# tolerance in degrees for simplifying geometries, well below a pixel of
+# the most zoomed-in map
+SIMPLIFY_TOLERANCE = 0.0001
+
+NEIGHBOUR_CODES = ('BI', 'RW', 'CD', 'UG', 'KE', 'ZM', 'MW', 'MZ', 'SO')
+LAKES = (
+    'Lake Victoria',
+    'Lake Tanganyika',
+    'Lake Malawi',
+    'Lake Kivu',
+    'Lake Edward',
+    'Lake Rukwa',
+    'Lake Bunyoni',
+    'Lake Natron',
+    'Lake Manyara',
+    'Lake Lembeni',
+    'Lake Eyasi'
+)
+GEOMETRY_LAYERS = ('neighbours', 'regions', 'lakes', 'tanzania')
+LABEL_LAYERS = ('regions', 'lakes')
+
+_basemaps = {}
+
+
+def read_basemap(data_path, cache_dir=None):
+    """Basemap layers, loaded once per process
+
+    Returns
+    -------
+    dict
+        with a list of shapely geometries for each of `GEOMETRY_LAYERS`,
+        and for each of `LABEL_LAYERS` a list of (name, cx, cy) at the
+        centroid of each unclipped region or lake, under the key
+        '{layer}_labels'
+    """
+    if data_path not in _basemaps:
+        _basemaps[data_path] = _load_basemap(data_path, cache_dir)
+    return _basemaps[data_path]
+
+
+def basemap_filenames(data_path):
+    """Natural Earth shapefiles, as dict of name => path
+    """
+    boundaries_path = os.path.join(data_path, 'Infrastructure', 'Boundaries')
+    return {
+        'states': os.path.join(boundaries_path, 'ne_10m_admin_0_countries_lakes.shp'),
+        'states_over_lakes': os.path.join(boundaries_path, 'ne_10m_admin_0_countries.shp'),
+        'provinces': os.path.join(boundaries_path, 'ne_10m_admin_1_states_provinces_lakes.shp'),
+        'lakes': os.path.join(boundaries_path, 'ne_10m_lakes.shp')
+    }
+
+
+def _load_basemap(data_path, cache_dir):
+    filenames = basemap_filenames(data_path)
+    sha = hashlib.sha1()
+    sha.update(str(BASEMAP_CACHE_VERSION).encode('utf-8'))
+    for name in sorted(filenames):
+        update_shapefile_hash(sha, filenames[name])
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(filenames['states']), '.basemap_cache')
+    cache_path = os.path.join(cache_dir, sha.hexdigest())
+
+    if not os.path.exists(cache_path):
+        save_arrays(_pack_basemap(build_basemap(filenames)), cache_path)
+    return _unpack_basemap(load_arrays(cache_path, mmap_mode=None))
+
+
+def build_basemap(filenames):
+    """Filter, clip and simplify basemap layers from the Natural Earth
+    shapefiles, as read by `read_basemap`
+    """
+    clip_box = box(*CLIP_BOUNDS)
+    layers = {layer: [] for layer in GEOMETRY_LAYERS}
+    labels = {layer: [] for layer in LABEL_LAYERS}
+
+    def add(layer, geom):
+        geom = geom.intersection(clip_box)
+        if not geom.is_empty:
+            layers[layer].append(geom.simplify(SIMPLIFY_TOLERANCE))
+
+    for record in shpreader.Reader(filenames['states']).records():
+        if record.attributes['ISO_A2'] in NEIGHBOUR_CODES:
+            add('neighbours', record.geometry)
+
+    for record in shpreader.Reader(filenames['provinces']).records():
+        if record.attributes['iso_a2'] == 'TZ':
+            centroid = record.geometry.centroid
+            labels['regions'].append((record.attributes['name'], centroid.x, centroid.y))
+            add('regions', record.geometry)
+
+    for record in shpreader.Reader(filenames['lakes']).records():
+        if record.attributes['name'] in LAKES:
+            centroid = record.geometry.centroid
+            labels['lakes'].append((record.attributes['name'], centroid.x, centroid.y))
+            add('lakes', record.geometry)
+
+    for record in shpreader.Reader(filenames['states_over_lakes']).records():
+        if record.attributes['ISO_A2'] == 'TZ':
+            add('tanzania', record.geometry)
+
+    basemap = dict(layers)
+    for layer in LABEL_LAYERS:
+        basemap[layer + '_labels'] = labels[layer]
+    return basemap
+
+
+def _pack_basemap(basemap):
+    """Basemap layers as arrays of concatenated WKB with offsets, and label
+    names and centroids
+    """
+    arrays = {}
+    for layer in GEOMETRY_LAYERS:
+        wkbs = [shapely.wkb.dumps(geom) for geom in basemap[layer]]
+        offsets = np.zeros(len(wkbs) + 1, dtype=np.int64)
+        np.cumsum([len(wkb) for wkb in wkbs], out=offsets[1:])
+        arrays[layer + '_wkb'] = np.frombuffer(b''.join(wkbs), dtype=np.uint8)
+        arrays[layer + '_offsets'] = offsets
+    for layer in LABEL_LAYERS:
+        labels = basemap[layer + '_labels']
+        arrays[layer + '_names'] = np.array([name for name, _, _ in labels], dtype='U')
+        arrays[layer + '_centroids'] = np.array(
+            [(cx, cy) for _, cx, cy in labels], dtype=np.float64).reshape(-1, 2)
+    return arrays
+
+
+def _unpack_basemap(arrays):
+    basemap = {}
+    for layer in GEOMETRY_LAYERS:
+        wkb = arrays[layer + '_wkb'].tobytes()
+        offsets = arrays[layer + '_offsets'].tolist()
+        basemap[layer] = [
+            shapely.wkb.loads(wkb[start:end]) for start, end in zip(offsets[:-1], offsets[1:])
+        ]
+    for layer in LABEL_LAYERS:
+        basemap[layer + '_labels'] = [
+            (name, cx, cy) for name, (cx, cy) in zip(
+                arrays[layer + '_names'].tolist(), arrays[layer + '_centroids'].tolist())
+        ]
+    return basemap
@@ -0,0 +1,53 @@
+"""On-disk caches of NumPy arrays
+
+Derived data (compiled networks, rasterised pixels, overviews, exposure
+matrices and the like) is cached as a directory of .npy files, one per
+array, which later runs memory-map. Cache keys hash the source files, so
+a cache is rebuilt whenever its inputs change.
+"""
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+
+def update_shapefile_hash(sha, path):
+    """Update a hashlib hash with the contents of a shapefile and its
+    .shx, .dbf and .prj sidecar files
+    """
+    base, _ = os.path.splitext(path)
+    for ext in ('.shp', '.shx', '.dbf', '.prj'):
+        if not os.path.exists(base + ext):
+            continue
+        with open(base + ext, 'rb') as fh:
+            for chunk in iter(lambda: fh.read(1 << 20), b''):
+                sha.update(chunk)
+
+
+def save_arrays(arrays, path):
+    """Save a dict of name => numpy.ndarray as a directory of .npy files
+
+    Files are written to a temporary directory and moved into place, so that
+    an interrupted run never leaves a partial directory behind.
+    """
+    parent = os.path.dirname(path)
+    os.makedirs(parent, exist_ok=True)
+    tmp_path = tempfile.mkdtemp(dir=parent)
+    for key, values in arrays.items():
+        np.save(os.path.join(tmp_path, key + '.npy'), values)
+    try:
+        os.rename(tmp_path, path)
+    except OSError:
+        # another process saved the same arrays first
+        shutil.rmtree(tmp_path)
+
+
+def load_arrays(path, mmap_mode='r'):
+    """Load a directory of .npy files saved by `save_arrays`
+    """
+    arrays = {}
+    for filename in os.listdir(path):
+        key, _ = os.path.splitext(filename)
+        arrays[key] = np.load(os.path.join(path, filename), mmap_mode=mmap_mode)
+    return arrays
@@ -0,0 +1,481 @@
+"""Contraction hierarchies for repeated shortest-path queries
+
+A contraction hierarchy is built once per network and weight: nodes are
+contracted one at a time, from least to most important, adding a shortcut
+edge between two neighbours of the contracted node wherever the route
+through it is the only shortest route between them. A query is then two
+small Dijkstra searches, from source and target, which only ever move to
+more important nodes ("upward"), so OD assignment over many pairs costs
+milliseconds per pair instead of a search over the whole network.
+
+The upward graph is stored as CSR arrays in the same way as
+`scripts.network.CompiledNetwork`:
+
+- `offsets`, `neighbours`, `weights` for each node's upward edges
+- `edges`: original edge id of each upward edge, -1 for shortcuts
+- `children`: (n, 2) the two upward edges a shortcut replaces, -1 for
+  original edges
+
+`read_hierarchy` caches hierarchies on disk beside the compiled network
+cache, and memory-maps them on later runs.
+"""
+import heapq
+import os
+
+import numpy as np
+
+from scripts.cache import load_arrays, save_arrays
+from scripts.network import network_cache_path, read_network
+
+# Bump when the hierarchy layout changes, to invalidate cached hierarchies
+HIERARCHY_CACHE_VERSION = 1
+HIERARCHY_ARRAYS = ('rank', 'offsets', 'neighbours', 'weights', 'edges', 'children')
+
+
+class Hierarchy(object):
+    """Contraction hierarchy over the nodes of a CompiledNetwork
+
+    Attributes
+    ----------
+    rank : numpy.ndarray
+        (n_nodes) contraction order of each node
+    offsets : numpy.ndarray
+        (n_nodes + 1) start of each node's entries in `neighbours`
+    neighbours : numpy.ndarray
+        higher ranked node at the far end of each upward edge
+    weights : numpy.ndarray
+        weight of each upward edge
+    edges : numpy.ndarray
+        original edge id of each upward edge, -1 for shortcuts
+    children : numpy.ndarray
+        (n, 2) upward edges replaced by each shortcut, -1 for original edges
+    """
+    def __init__(self, rank, offsets, neighbours, weights, edges, children):
+        self.rank = rank
+        self.offsets = offsets
+        self.neighbours = neighbours
+        self.weights = weights
+        self.edges = edges
+        self.children = children
+        self.owners = np.repeat(
+            np.arange(len(offsets) - 1, dtype=np.int32), np.diff(offsets))
+
+    @property
+    def n_nodes(self):
+        return len(self.rank)
+
+    def upward_search(self, node, limit=np.inf):
+        """Dijkstra search from node over upward edges only
+
+        Returns
+        -------
+        tuple(dict, dict)
+            node id => distance and node id => upward edge used to reach it
+        """
+        offsets = self.offsets
+        neighbours = self.neighbours
+        weights = self.weights
+
+        dist = {node: 0.0}
+        pred = {}
+        settled = set()
+        heap = [(0.0, node)]
+        while heap:
+            d, current = heapq.heappop(heap)
+            if d > limit:
+                break
+            if current in settled:
+                continue
+            settled.add(current)
+            for i in range(offsets[current], offsets[current + 1]):
+                nbr = int(neighbours[i])
+                nbr_dist = d + weights[i]
+                if nbr_dist < dist.get(nbr, np.inf):
+                    dist[nbr] = nbr_dist
+                    pred[nbr] = i
+                    heapq.heappush(heap, (nbr_dist, nbr))
+        return dist, pred
+
+    def query(self, source, target):
+        """Shortest path between node ids, by bidirectional upward search
+
+        Returns
+        -------
+        tuple(float, list)
+            path weight and list of upward edges from source to target, as
+            (edge, reversed) pairs, or (inf, None) if target is unreachable
+        """
+        if source == target:
+            return 0.0, []
+
+        offsets = self.offsets
+        neighbours = self.neighbours
+        weights = self.weights
+
+        dist = ({source: 0.0}, {target: 0.0})
+        pred = ({}, {})
+        settled = (set(), set())
+        heaps = ([(0.0, source)], [(0.0, target)])
+        best = np.inf
+        meeting = None
+        while heaps[0] or heaps[1]:
+            # each side can stop once its closest unsettled node is further
+            # than the best path found so far
+            for side in (0, 1):
+                if heaps[side] and heaps[side][0][0] >= best:
+                    heaps[side][:] = []
+            if not heaps[0] and not heaps[1]:
+                break
+            if not heaps[1] or (heaps[0] and heaps[0][0][0] <= heaps[1][0][0]):
+                side = 0
+            else:
+                side = 1
+            d, node = heapq.heappop(heaps[side])
+            if node in settled[side]:
+                continue
+            settled[side].add(node)
+
+            other = dist[1 - side].get(node)
+            if other is not None and d + other < best:
+                best = d + other
+                meeting = node
+
+            for i in range(offsets[node], offsets[node + 1]):
+                nbr = int(neighbours[i])
+                nbr_dist = d + weights[i]
+                if nbr_dist < dist[side].get(nbr, np.inf):
+                    dist[side][nbr] = nbr_dist
+                    pred[side][nbr] = i
+                    heapq.heappush(heaps[side], (nbr_dist, nbr))
+
+        if meeting is None:
+            return np.inf, None
+        return best, self._join(pred[0], pred[1], meeting)
+
+    def _join(self, forward_pred, backward_pred, meeting):
+        """Upward edges from source up to meeting and back down to target
+        """
+        forward = []
+        node = meeting
+        while node in forward_pred:
+            i = forward_pred[node]
+            forward.append((i, False))
+            node = int(self.owners[i])
+        backward = []
+        node = meeting
+        while node in backward_pred:
+            i = backward_pred[node]
+            backward.append((i, True))
+            node = int(self.owners[i])
+        return forward[::-1] + backward
+
+    def unpack(self, upward_path):
+        """Expand a list of (upward edge, reversed) pairs into original
+        edges, returning lists of original edge ids and of node ids
+        """
+        edges = []
+        nodes = []
+        stack = upward_path[::-1]
+        while stack:
+            i, reverse = stack.pop()
+            first, second = self.children[i]
+            if first < 0:
+                edges.append(int(self.edges[i]))
+                if reverse:
+                    nodes.append(int(self.owners[i]))
+                else:
+                    nodes.append(int(self.neighbours[i]))
+            elif reverse:
+                # neighbour -> middle -> owner
+                stack.append((first, False))
+                stack.append((second, True))
+            else:
+                # owner -> middle -> neighbour
+                stack.append((second, False))
+                stack.append((first, True))
+        return edges, nodes
+
+    def distance(self, source, target):
+        """Shortest path weight between node ids (inf if unreachable)
+        """
+        dist, _ = self.query(source, target)
+        return dist
+
+    def path(self, source, target):
+        """Shortest path between node ids
+
+        Returns
+        -------
+        tuple(float, list)
+            path weight and list of node ids from source to target, or
+            (inf, []) if target is unreachable
+        """
+        dist, upward_path = self.query(source, target)
+        if upward_path is None:
+            return np.inf, []
+        _, nodes = self.unpack(upward_path)
+        return dist, [source] + nodes
+
+    def path_edges(self, source, target):
+        """Original edge ids along the shortest path between node ids, or
+        None if target is unreachable
+        """
+        _, upward_path = self.query(source, target)
+        if upward_path is None:
+            return None
+        edges, _ = self.unpack(upward_path)
+        return edges
+
+
+def build_hierarchy(net, weight='distance', witness_limit=100):
+    """Contract a CompiledNetwork into a Hierarchy
+
+    Nodes are contracted in order of edge difference (shortcuts added less
+    edges removed) plus the number of already contracted neighbours, with
+    priorities updated lazily. Edges with nan weight (e.g. unknown travel
+    time) are left out.
+
+    Parameters
+    ----------
+    net : scripts.network.CompiledNetwork
+    weight : str
+        'distance', 't_time' or the name of a numeric edge attribute
+    witness_limit : int
+        maximum number of nodes settled by each witness search; lower builds
+        faster but adds more (redundant) shortcuts
+    """
+    n_nodes = net.n_nodes
+    edge_weights = np.asarray(net.weights(weight), dtype=np.float64).tolist()
+
+    # per-node dict of neighbour => (weight, middle node, original edge id),
+    # keeping the lowest weight edge between each pair of nodes
+    graph = [{} for _ in range(n_nodes)]
+    for edge, (n0, n1) in enumerate(net.edge_nodes.tolist()):
+        w = edge_weights[edge]
+        if w != w:
+            continue
+        if w < graph[n0].get(n1, (np.inf,))[0]:
+            graph[n0][n1] = (w, -1, edge)
+            graph[n1][n0] = (w, -1, edge)
+
+    contracted_neighbours = [0] * n_nodes
+    heap = [
+        (_priority(graph, node, contracted_neighbours, witness_limit), node)
+        for node in range(n_nodes)
+    ]
+    heapq.heapify(heap)
+
+    rank = np.zeros(n_nodes, dtype=np.int32)
+    upward = [None] * n_nodes
+    order = 0
+    while heap:
+        _, node = heapq.heappop(heap)
+        shortcuts = _shortcuts(graph, node, witness_limit)
+        priority = len(shortcuts) - len(graph[node]) + contracted_neighbours[node]
+        if heap and priority > heap[0][0]:
+            heapq.heappush(heap, (priority, node))
+            continue
+
+        for n0, n1, w in shortcuts:
+            if w < graph[n0].get(n1, (np.inf,))[0]:
+                graph[n0][n1] = (w, node, -1)
+                graph[n1][n0] = (w, node, -1)
+
+        # remaining edges all lead to higher ranked nodes
+        upward[node] = graph[node]
+        for nbr in graph[node]:
+            del graph[nbr][node]
+            contracted_neighbours[nbr] += 1
+        graph[node] = None
+        rank[node] = order
+        order += 1
+
+    return _upward_arrays(rank, upward)
+
+
+def _priority(graph, node, contracted_neighbours, witness_limit):
+    return len(_shortcuts(graph, node, witness_limit)) - len(graph[node]) \
+        + contracted_neighbours[node]
+
+
+def _shortcuts(graph, node, witness_limit):
+    """Shortcuts needed to contract node, as (n0, n1, weight) tuples
+    """
+    nbrs = list(graph[node].items())
+    shortcuts = []
+    for i, (n0, (w0, _, _)) in enumerate(nbrs):
+        targets = {n1: w0 + w1 for n1, (w1, _, _) in nbrs[i + 1:]}
+        if not targets:
+            continue
+        witness = _witness_search(
+            graph, n0, node, targets, max(targets.values()), witness_limit)
+        for n1, w in targets.items():
+            if witness.get(n1, np.inf) > w:
+                shortcuts.append((n0, n1, w))
+    return shortcuts
+
+
+def _witness_search(graph, source, avoid, targets, max_dist, witness_limit):
+    """Dijkstra search from source around node avoid, until all targets are
+    settled, max_dist is passed or witness_limit nodes are settled
+    """
+    dist = {source: 0.0}
+    settled = set()
+    remaining = len(targets)
+    heap = [(0.0, source)]
+    while heap and remaining and len(settled) < witness_limit:
+        d, node = heapq.heappop(heap)
+        if d > max_dist:
+            break
+        if node in settled:
+            continue
+        settled.add(node)
+        if node in targets:
+            remaining -= 1
+        for nbr, (w, _, _) in graph[node].items():
+            if nbr == avoid:
+                continue
+            nbr_dist = d + w
+            if nbr_dist < dist.get(nbr, np.inf):
+                dist[nbr] = nbr_dist
+                heapq.heappush(heap, (nbr_dist, nbr))
+    return dist
+
+
+def _upward_arrays(rank, upward):
+    """Flatten per-node upward edge dicts into a Hierarchy
+    """
+    n_nodes = len(rank)
+    counts = np.array([len(edges) for edges in upward], dtype=np.int64)
+    offsets = np.zeros(n_nodes + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+
+    n = int(offsets[-1])
+    neighbours = np.empty(n, dtype=np.int32)
+    weights = np.empty(n, dtype=np.float64)
+    edges = np.empty(n, dtype=np.int32)
+    middles = np.empty(n, dtype=np.int64)
+    index = {}
+    i = 0
+    for node, node_edges in enumerate(upward):
+        for nbr, (w, middle, edge) in node_edges.items():
+            neighbours[i] = nbr
+            weights[i] = w
+            edges[i] = edge
+            middles[i] = middle
+            index[(node, nbr)] = i
+            i += 1
+
+    # a shortcut between owner and neighbour replaces the two upward edges
+    # of its (lower ranked) middle node
+    owners = np.repeat(np.arange(n_nodes), counts)
+    children = np.full((n, 2), -1, dtype=np.int64)
+    for i in np.nonzero(middles >= 0)[0].tolist():
+        middle = int(middles[i])
+        children[i, 0] = index[(middle, int(owners[i]))]
+        children[i, 1] = index[(middle, int(neighbours[i]))]
+
+    return Hierarchy(rank, offsets, neighbours, weights, edges, children)
+
+
+def read_hierarchy(path, weight='distance', speeds=None, speed_attr='highway',
+                   attributes=('osm_id', 'name', 'highway'), cache_dir=None):
+    """Read the contraction hierarchy of a network shapefile
+
+    The hierarchy is built on first use and cached beside the compiled
+    network cache (see `scripts.network.read_network`), which also
+    invalidates it when the shapefile changes.
+
+    Parameters
+    ----------
+    path : str
+        network shapefile
+    weight : str
+        'distance', 't_time' or the name of a numeric edge attribute
+    speeds, speed_attr, attributes, cache_dir
+        as for `scripts.network.read_network`
+    """
+    network_path = network_cache_path(path, speeds, speed_attr, attributes, cache_dir)
+    cache_path = '{}-ch{}-{}'.format(network_path, HIERARCHY_CACHE_VERSION, weight)
+    if os.path.exists(cache_path):
+        return load_hierarchy(cache_path)
+
+    net = read_network(path, speeds, speed_attr, attributes, cache_dir)
+    hierarchy = build_hierarchy(net, weight)
+    save_hierarchy(hierarchy, cache_path)
+    return hierarchy
+
+
+def save_hierarchy(hierarchy, cache_path):
+    """Save a Hierarchy as a directory of .npy files
+    """
+    save_arrays(
+        {key: getattr(hierarchy, key) for key in HIERARCHY_ARRAYS}, cache_path)
+
+
+def load_hierarchy(cache_path, mmap_mode='r'):
+    """Load a Hierarchy saved by `save_hierarchy`
+    """
+    arrays = load_arrays(cache_path, mmap_mode)
+    return Hierarchy(*[arrays[key] for key in HIERARCHY_ARRAYS])
+
+
+def assign_flows(hierarchy, origins, destinations, flows, n_edges):
+    """Assign OD flows to shortest paths, summing flow on each original edge
+
+    Upward searches are run once per distinct origin and destination node,
+    then each OD pair only needs to join the two search spaces.
+
+    Parameters
+    ----------
+    hierarchy : Hierarchy
+    origins, destinations : array-like
+        origin and destination node ids
+    flows : array-like
+        flow between each origin and destination
+    n_edges : int
+        number of edges in the network
+
+    Returns
+    -------
+    tuple(numpy.ndarray, numpy.ndarray)
+        total flow on each edge, and path weight of each OD pair (inf where
+        unreachable, in which case its flow is not assigned)
+    """
+    origins = np.asarray(origins, dtype=np.int64)
+    destinations = np.asarray(destinations, dtype=np.int64)
+    flows = np.asarray(flows, dtype=np.float64)
+
+    searches = {}
+    for node in np.unique(np.concatenate([origins, destinations])).tolist():
+        searches[node] = hierarchy.upward_search(node)
+
+    edge_flows = np.zeros(n_edges)
+    od_dist = np.full(len(origins), np.inf)
+    for k, (origin, destination) in enumerate(zip(origins.tolist(), destinations.tolist())):
+        if origin == destination:
+            od_dist[k] = 0
+            continue
+        forward_dist, forward_pred = searches[origin]
+        backward_dist, backward_pred = searches[destination]
+        if len(backward_dist) < len(forward_dist):
+            smaller, larger = backward_dist, forward_dist
+        else:
+            smaller, larger = forward_dist, backward_dist
+
+        best = np.inf
+        meeting = None
+        for node, d in smaller.items():
+            other = larger.get(node)
+            if other is not None and d + other < best:
+                best = d + other
+                meeting = node
+        if meeting is None:
+            continue
+
+        od_dist[k] = best
+        edges, _ = hierarchy.unpack(
+            hierarchy._join(forward_pred, backward_pred, meeting))
+        edge_flows[edges] += flows[k]
+
+    return edge_flows, od_dist
@@ -0,0 +1,527 @@
+"""Network disruption: rerouting OD routes around failed edges
+
+`edge_failure_factors` measures how much longer routes become when each
+edge fails on its own (single point of failure analysis). Rather than
+re-solving every route once per failed edge, it builds the shortest path
+tree from each origin once, and for every tree edge used by a route to one
+of the origin's destinations only repairs the subtree hanging below that
+edge: nodes outside the subtree keep their distances, so the subtree is
+re-settled from its boundary by a Dijkstra search confined to it. Each
+tree only reaches out as far as the origin's routes and their repairs
+need, doubling its radius from twice the origin's longest edge, so the
+work per origin depends on the neighbourhood searched rather than on the
+size of the network. Bridges, found once for the whole network, cut off
+every route below them without a repair.
+
+For failures of several edges at once, `od_routes` finds the baseline
+route of each OD pair and indexes the pairs by the edges they use, so that
+`reroute` only searches again from the origins of routes which use a failed
+edge. `evaluate_scenarios` runs many such scenarios over a process pool,
+with workers memory-mapping the compiled network and routes from disk
+rather than each receiving a copy. `hazard_scenarios` turns a hazard
+exposure table into one such scenario per hazard layer and depth threshold.
+"""
+import heapq
+from multiprocessing import Pool
+
+import numpy as np
+from scipy.sparse.csgraph import dijkstra
+
+from scripts.cache import load_arrays, save_arrays
+from scripts.network import (
+    bridges_and_components, load_network, shortest_path_tree)
+
+ROUTE_ARRAYS = (
+    'origins', 'destinations', 'dist', 'route_offsets', 'route_edges',
+    'edge_offsets', 'edge_ods'
+)
+
+
+def edge_failure_factors(net, origins, destinations, weight='distance', edge_mask=None):
+    """Route length increase factor for OD pairs when each edge fails
+
+    Parameters
+    ----------
+    net : scripts.network.CompiledNetwork
+    origins, destinations : array-like
+        origin and destination node ids of each OD pair
+    weight : str
+        'distance', 't_time' or the name of a numeric edge attribute
+    edge_mask : numpy.ndarray, optional
+        boolean array over edge ids, False for edges already failed
+
+    Returns
+    -------
+    tuple(numpy.ndarray, numpy.ndarray)
+        per-edge increase factor, (new - old) / old route weight, maximised
+        over the OD pairs which stay connected when the edge fails (0 for
+        edges not on any route), and per-edge number of OD pairs which are
+        disconnected when the edge fails
+    """
+    origins = np.asarray(origins, dtype=np.int64)
+    destinations = np.asarray(destinations, dtype=np.int64)
+    edge_weights = net.weights(weight)
+    bridges, component = bridges_and_components(net, edge_mask)
+
+    # search radius bounds: at least one edge, at most the whole network
+    positive = edge_weights[edge_weights > 0]
+    min_limit = positive.min() if len(positive) else 1.0
+    max_limit = np.nansum(edge_weights)
+
+    incr_fact = np.zeros(net.n_edges)
+    disconnected = np.zeros(net.n_edges, dtype=np.int64)
+
+    # workspace arrays, reset after each search and repair
+    dist = np.full(net.n_nodes, np.inf)
+    pred = np.full(net.n_nodes, -1, dtype=np.int64)
+    pred_edge = np.full(net.n_nodes, -1, dtype=np.int64)
+    in_subtree = np.zeros(net.n_nodes, dtype=bool)
+    repaired = np.full(net.n_nodes, np.inf)
+
+    order = np.argsort(origins, kind='mergesort')
+    origins = origins[order]
+    destinations = destinations[order]
+    starts = np.flatnonzero(np.r_[True, origins[1:] != origins[:-1]])
+    for origin, od_dests in zip(origins[starts].tolist(), np.split(destinations, starts[1:])):
+        od_dests = np.unique(od_dests)
+        od_dests = od_dests[(od_dests != origin) & (component[od_dests] == component[origin])]
+        if not len(od_dests):
+            continue
+
+        # search out to twice the origin's longest edge, doubling until the
+        # routes and their repairs all lie within the search
+        origin_edges = net.adj_edges[net.offsets[origin]:net.offsets[origin + 1]]
+        limit = max(2 * np.nanmax(edge_weights[origin_edges], initial=0), min_limit)
+        while True:
+            complete = limit >= max_limit
+            settled = _bounded_tree(
+                net, origin, limit, edge_weights, edge_mask, dist, pred, pred_edge)
+            reached = np.isfinite(dist[od_dests])
+            failures = None
+            if complete or reached.all():
+                failures = _origin_failures(
+                    net, settled, od_dests[reached], limit, complete, bridges,
+                    edge_weights, edge_mask, dist, pred, pred_edge, in_subtree, repaired)
+            dist[settled] = np.inf
+            pred[settled] = -1
+            pred_edge[settled] = -1
+            if failures is not None:
+                break
+            limit *= 2
+
+        for edge, factor, n_disconnected in failures:
+            disconnected[edge] += n_disconnected
+            incr_fact[edge] = max(incr_fact[edge], factor)
+
+    return incr_fact, disconnected
+
+
+def _bounded_tree(net, source, limit, edge_weights, edge_mask, dist, pred, pred_edge):
+    """Shortest path tree from source out to distance limit, written into
+    the dist, pred and pred_edge workspace arrays
+
+    Returns
+    -------
+    list
+        node ids settled, in order of distance; only these are left written,
+        so resetting them restores the workspace
+    """
+    offsets = net.offsets
+    neighbours = net.neighbours
+    adj_edges = net.adj_edges
+
+    dist[source] = 0
+    settled = []
+    done = set()
+    reached = [source]
+    heap = [(0.0, source)]
+    while heap:
+        d, node = heapq.heappop(heap)
+        if d > limit:
+            break
+        if node in done:
+            continue
+        done.add(node)
+        settled.append(node)
+
+        start, end = offsets[node], offsets[node + 1]
+        nbrs = neighbours[start:end]
+        edges = adj_edges[start:end]
+        new_dist = d + edge_weights[edges]
+        better = new_dist < dist[nbrs]
+        if edge_mask is not None:
+            better &= edge_mask[edges]
+        for nbr, edge, nbr_dist in zip(
+                nbrs[better].tolist(), edges[better].tolist(), new_dist[better].tolist()):
+            if nbr_dist < dist[nbr]:
+                dist[nbr] = nbr_dist
+                pred[nbr] = node
+                pred_edge[nbr] = edge
+                reached.append(nbr)
+                heapq.heappush(heap, (nbr_dist, nbr))
+
+    # forget nodes reached but not settled within the limit
+    unsettled = [node for node in reached if node not in done]
+    dist[unsettled] = np.inf
+    pred[unsettled] = -1
+    pred_edge[unsettled] = -1
+    return settled
+
+
+def _origin_failures(net, settled, od_dests, limit, complete, bridges, edge_weights,
+                     edge_mask, dist, pred, pred_edge, in_subtree, repaired):
+    """Failure of each tree edge on the routes from one origin, as a list of
+    (edge, increase factor, number of disconnected OD pairs)
+
+    Returns None if a repaired route may run beyond the search limit, and so
+    needs a wider search, unless the search is complete.
+    """
+    children = _tree_children(settled, pred)
+    failures = []
+    for child in _route_nodes(pred, od_dests):
+        edge = int(pred_edge[child])
+        subtree = _subtree(children, child)
+        in_subtree[subtree] = True
+        affected = od_dests[in_subtree[od_dests]]
+
+        if bridges[edge]:
+            # every route below a bridge is cut off
+            failures.append((edge, 0.0, len(affected)))
+            in_subtree[subtree] = False
+            continue
+
+        _repair(net, dist, subtree, in_subtree, edge, edge_weights, edge_mask, repaired)
+        new_dist = repaired[affected]
+        old_dist = dist[affected]
+        in_subtree[subtree] = False
+        repaired[subtree] = np.inf
+        if not complete and not (new_dist <= limit).all():
+            return None
+
+        connected = np.isfinite(new_dist)
+        factor = 0.0
+        if connected.any():
+            with np.errstate(divide='ignore', invalid='ignore'):
+                factors = (new_dist[connected] - old_dist[connected]) / old_dist[connected]
+            factor = np.nanmax(factors)
+        failures.append((edge, factor, np.count_nonzero(~connected)))
+    return failures
+
+
+def _tree_children(settled, pred):
+    """Children of each node in a predecessor tree, as dict of node => list
+    """
+    children = {}
+    for node, parent in zip(settled[1:], pred[settled[1:]].tolist()):
+        children.setdefault(parent, []).append(node)
+    return children
+
+
+def _route_nodes(pred, dests):
+    """Nodes on the tree routes to dests, excluding the root, i.e. one node
+    below each tree edge used by a route
+    """
+    seen = set()
+    for node in dests.tolist():
+        while node not in seen and pred[node] >= 0:
+            seen.add(node)
+            node = int(pred[node])
+    return seen
+
+
+def _subtree(children, node):
+    """Node ids in the subtree rooted at node
+    """
+    subtree = [node]
+    i = 0
+    while i < len(subtree):
+        subtree.extend(children.get(subtree[i], ()))
+        i += 1
+    return np.array(subtree, dtype=np.int64)
+
+
+def _repair(net, dist, subtree, in_subtree, failed_edge, edge_weights, edge_mask, repaired):
+    """Distances to subtree nodes once failed_edge is removed, written into
+    repaired
+
+    Nodes outside the subtree keep their distances, so each subtree node is
+    seeded with its best edge from outside and then settled by a Dijkstra
+    search which never leaves the subtree.
+    """
+    offsets = net.offsets
+    neighbours = net.neighbours
+    adj_edges = net.adj_edges
+
+    # gather adjacency entries of subtree nodes
+    starts = offsets[subtree]
+    counts = offsets[subtree + 1] - starts
+    owners = np.repeat(subtree, counts)
+    entries = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+    nbrs = neighbours[entries]
+    edges = adj_edges[entries]
+
+    usable = edges != failed_edge
+    if edge_mask is not None:
+        usable &= edge_mask[edges]
+    boundary = usable & ~in_subtree[nbrs]
+    np.minimum.at(
+        repaired, owners[boundary], dist[nbrs[boundary]] + edge_weights[edges[boundary]])
+
+    heap = [(d, node) for node, d in zip(subtree.tolist(), repaired[subtree].tolist())
+            if d < np.inf]
+    heapq.heapify(heap)
+    settled = set()
+    while heap:
+        d, node = heapq.heappop(heap)
+        if node in settled:
+            continue
+        settled.add(node)
+        start, end = offsets[node], offsets[node + 1]
+        node_nbrs = neighbours[start:end]
+        node_edges = adj_edges[start:end]
+        keep = in_subtree[node_nbrs] & (node_edges != failed_edge)
+        if edge_mask is not None:
+            keep &= edge_mask[node_edges]
+        new_dist = d + edge_weights[node_edges[keep]]
+        node_nbrs = node_nbrs[keep]
+        better = new_dist < repaired[node_nbrs]
+        for nbr, nbr_dist in zip(node_nbrs[better].tolist(), new_dist[better].tolist()):
+            if nbr_dist < repaired[nbr]:
+                repaired[nbr] = nbr_dist
+                heapq.heappush(heap, (nbr_dist, nbr))
+
+
+class Routes(object):
+    """Shortest routes between OD pairs, indexed by the edges they use
+
+    Attributes
+    ----------
+    origins, destinations : numpy.ndarray
+        origin and destination node ids of each OD pair
+    dist : numpy.ndarray
+        route weight of each OD pair (inf where unreachable)
+    route_offsets : numpy.ndarray
+        (n_ods + 1) start of each route's edges in `route_edges`
+    route_edges : numpy.ndarray
+        edge ids along each route, route by route
+    edge_offsets : numpy.ndarray
+        (n_edges + 1) start of each edge's entries in `edge_ods`
+    edge_ods : numpy.ndarray
+        ids of the OD pairs routed over each edge, edge by edge
+    """
+    def __init__(self, origins, destinations, dist, route_offsets, route_edges,
+                 edge_offsets, edge_ods):
+        self.origins = origins
+        self.destinations = destinations
+        self.dist = dist
+        self.route_offsets = route_offsets
+        self.route_edges = route_edges
+        self.edge_offsets = edge_offsets
+        self.edge_ods = edge_ods
+
+    def edges(self, od):
+        """Edge ids along the route of an OD pair
+        """
+        return self.route_edges[self.route_offsets[od]:self.route_offsets[od + 1]]
+
+    def affected(self, edges):
+        """Ids of the OD pairs whose routes use any of edges
+        """
+        edges = np.asarray(edges, dtype=np.int64)
+        if not len(edges):
+            return np.zeros(0, dtype=np.int64)
+        return np.unique(np.concatenate([
+            self.edge_ods[self.edge_offsets[edge]:self.edge_offsets[edge + 1]]
+            for edge in edges.tolist()
+        ]))
+
+
+def od_routes(net, origins, destinations, weight='distance', edge_mask=None):
+    """Shortest routes between OD pairs, one shortest path tree per origin
+
+    Returns
+    -------
+    Routes
+    """
+    origins = np.asarray(origins, dtype=np.int64)
+    destinations = np.asarray(destinations, dtype=np.int64)
+    dist = np.full(len(origins), np.inf)
+    route_edges = [[] for _ in range(len(origins))]
+
+    order = np.argsort(origins, kind='mergesort')
+    starts = np.flatnonzero(np.r_[True, origins[order][1:] != origins[order][:-1]])
+    for ods in np.split(order, starts[1:]):
+        if not len(ods):
+            continue
+        tree_dist, pred, pred_edge = shortest_path_tree(
+            net, origins[ods[0]], weight, edge_mask)
+        for od in ods.tolist():
+            node = destinations[od]
+            dist[od] = tree_dist[node]
+            edges = route_edges[od]
+            while pred[node] >= 0:
+                edges.append(int(pred_edge[node]))
+                node = pred[node]
+            edges.reverse()
+
+    counts = np.array([len(edges) for edges in route_edges], dtype=np.int64)
+    route_offsets = np.zeros(len(origins) + 1, dtype=np.int64)
+    np.cumsum(counts, out=route_offsets[1:])
+    flat_edges = np.fromiter(
+        (edge for edges in route_edges for edge in edges), dtype=np.int64,
+        count=route_offsets[-1])
+
+    # invert to the OD pairs routed over each edge
+    route_ods = np.repeat(np.arange(len(origins)), counts)
+    by_edge = np.argsort(flat_edges, kind='mergesort')
+    edge_offsets = np.searchsorted(flat_edges[by_edge], np.arange(net.n_edges + 1))
+    return Routes(origins, destinations, dist, route_offsets, flat_edges,
+                  edge_offsets, route_ods[by_edge])
+
+
+def save_routes(routes, path):
+    """Save Routes as a directory of .npy files
+    """
+    save_arrays({key: getattr(routes, key) for key in ROUTE_ARRAYS}, path)
+
+
+def load_routes(path, mmap_mode='r'):
+    """Load Routes saved by `save_routes`
+    """
+    arrays = load_arrays(path, mmap_mode)
+    return Routes(*[arrays[key] for key in ROUTE_ARRAYS])
+
+
+def reroute(net, routes, failed_edges, weight='distance', edge_mask=None):
+    """Reroute the OD pairs affected by the failure of a set of edges
+
+    Only the OD pairs whose routes use a failed edge are searched again,
+    once per distinct origin.
+
+    Parameters
+    ----------
+    net : scripts.network.CompiledNetwork
+    routes : Routes
+        baseline routes, found with the same weight and edge_mask
+    failed_edges : array-like
+        edge ids
+    edge_mask : numpy.ndarray, optional
+        boolean array over edge ids, False for edges already failed
+
+    Returns
+    -------
+    tuple(numpy.ndarray, numpy.ndarray)
+        ids of the affected OD pairs and their new route weights (inf where
+        disconnected)
+    """
+    ods = routes.affected(failed_edges)
+    new_dist = np.full(len(ods), np.inf)
+    if not len(ods):
+        return ods, new_dist
+
+    mask = np.ones(net.n_edges, dtype=bool) if edge_mask is None else edge_mask.copy()
+    mask[np.asarray(failed_edges, dtype=np.int64)] = False
+    adjacency = net.adjacency(weight, mask)
+
+    origins = routes.origins[ods]
+    for origin in np.unique(origins).tolist():
+        from_origin = origins == origin
+        dist = dijkstra(adjacency, directed=True, indices=origin)
+        new_dist[from_origin] = dist[routes.destinations[ods[from_origin]]]
+    return ods, new_dist
+
+
+def summarise_reroute(routes, ods, new_dist):
+    """Summarise rerouted OD pairs
+
+    Returns
+    -------
+    tuple(int, int, float, float)
+        number of affected OD pairs, number disconnected, largest route
+        weight increase factor and total route weight increase over those
+        still connected
+    """
+    old_dist = routes.dist[ods]
+    connected = np.isfinite(new_dist)
+    if not connected.any():
+        return len(ods), len(ods), 0.0, 0.0
+    increase = new_dist[connected] - old_dist[connected]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        incr_fact = np.nanmax(increase / old_dist[connected])
+    return len(ods), np.count_nonzero(~connected), incr_fact, np.sum(increase)
+
+
+def hazard_scenarios(net, exposure, id_key, thresholds=(0,)):
+    """Failed edges for each hazard layer and depth threshold
+
+    Parameters
+    ----------
+    net : scripts.network.CompiledNetwork
+    exposure : pandas.DataFrame
+        exposed network edges, with columns id, model, return_period and
+        flood_depth, as read by `scripts.exposure.read_exposure`
+    id_key : str
+        network edge attribute matching the exposure id column
+    thresholds : tuple
+        depths above which an exposed edge fails
+
+    Returns
+    -------
+    list
+        of ((model, return_period, threshold), failed edge ids)
+    """
+    edge_ids = net.attributes[id_key].astype(str)
+    scenarios = []
+    for (model, return_period), layer in exposure.groupby(['model', 'return_period'], observed=True):
+        for threshold in thresholds:
+            failed_ids = layer['id'][layer['flood_depth'] > threshold].astype(str).unique()
+            failed_edges = np.flatnonzero(np.isin(edge_ids, failed_ids))
+            scenarios.append(((model, return_period, threshold), failed_edges))
+    return scenarios
+
+
+def evaluate_scenarios(network_cache, routes_cache, scenarios, weight='distance',
+                       processes=None):
+    """Reroute OD pairs for many failure scenarios over a process pool
+
+    Each worker memory-maps the compiled network and baseline routes, so
+    they are read once into the page cache and shared between workers.
+
+    Parameters
+    ----------
+    network_cache : str
+        compiled network saved by `scripts.network.save_network` (as cached
+        by `scripts.network.read_network`)
+    routes_cache : str
+        baseline routes saved by `save_routes`
+    scenarios : iterable
+        sets of failed edge ids
+    processes : int, optional
+        number of worker processes, defaults to the number of CPUs
+
+    Yields
+    ------
+    tuple(int, numpy.ndarray, numpy.ndarray)
+        scenario index, ids of affected OD pairs and their new route
+        weights, in order of completion
+    """
+    with Pool(processes, initializer=_init_worker,
+              initargs=(network_cache, routes_cache)) as pool:
+        tasks = ((i, failed_edges, weight) for i, failed_edges in enumerate(scenarios))
+        for result in pool.imap_unordered(_evaluate_scenario, tasks, chunksize=4):
+            yield result
+
+
+_worker_state = {}
+
+
+def _init_worker(network_cache, routes_cache):
+    _worker_state['net'] = load_network(network_cache)
+    _worker_state['routes'] = load_routes(routes_cache)
+
+
+def _evaluate_scenario(task):
+    i, failed_edges, weight = task
+    ods, new_dist = reroute(
+        _worker_state['net'], _worker_state['routes'], failed_edges, weight)
+    return i, ods, new_dist
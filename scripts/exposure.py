@@ -0,0 +1,317 @@
+"""Columnar store for hazard exposure of network elements
+
+An exposure table has one row per network element and hazard layer where
+the element is exposed, with columns network_element, sector, id, model,
+return_period and flood_depth (and any extra element properties). It is
+written as Parquet with typed columns: strings are dictionary-encoded
+categories, id is an integer where every id is numeric, return_period is
+int16 and flood_depth float32. Rows are grouped by model, one row group
+per model, so readers load only the columns and models they need; row
+order is kept within each model, not across models.
+
+`ExposureMatrix` summarises a table as a binary sparse matrix, one row per
+(sector, id) asset and one column per (model, return_period, depth band)
+hazard layer, which `save_exposure_matrix` stores as .npy arrays.
+"""
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from scipy.sparse import csr_matrix
+
+from scripts.cache import load_arrays, save_arrays
+
+EXPOSURE_COLUMNS = [
+    'network_element', 'sector', 'id', 'model', 'return_period', 'flood_depth'
+]
+# models of current and future climate hazard layers
+CURRENT_MODELS = (
+    'EUWATCH', 'SSBN_FD', 'SSBN_FU', 'SSBN_PD', 'SSBN_PU', 'SSBN_UD', 'SSBN_UU'
+)
+FUTURE_MODELS = (
+    'GFDL-ESM2M', 'HadGEM2-ES', 'IPSL-CM5A-LR', 'MIROC-ESM-CHEM', 'NorESM1-M'
+)
+EXPOSURE_MATRIX_ARRAYS = (
+    'indptr', 'indices', 'sectors', 'ids', 'models', 'return_periods', 'bands', 'bounds'
+)
+
+
+class ExposureMatrix(object):
+    """Binary sparse matrix of assets exposed to hazard layers
+
+    Attributes
+    ----------
+    indptr, indices : numpy.ndarray
+        compressed sparse row (CSR) structure: the layers each asset is
+        exposed to are ``indices[indptr[i]:indptr[i + 1]]``, in column order
+    sectors, ids : numpy.ndarray
+        row labels, the sector and id (as str) of each asset
+    models, return_periods, bands : numpy.ndarray
+        column labels, sorted by model, return period then band, where band
+        is an index into `bounds`, or -1 for depths outside every band
+    bounds : numpy.ndarray
+        (n_bands, 2) lower and upper flood depth of each band, with
+        lower < depth <= upper
+    """
+    def __init__(self, indptr, indices, sectors, ids, models, return_periods, bands, bounds):
+        self.indptr = indptr
+        self.indices = indices
+        self.sectors = sectors
+        self.ids = ids
+        self.models = models
+        self.return_periods = return_periods
+        self.bands = bands
+        self.bounds = bounds
+
+    @property
+    def n_assets(self):
+        return len(self.sectors)
+
+    @property
+    def n_layers(self):
+        return len(self.models)
+
+    @property
+    def matrix(self):
+        """scipy.sparse.csr_matrix of bool, assets x layers
+        """
+        return csr_matrix(
+            (np.ones(len(self.indices), dtype=bool), self.indices, self.indptr),
+            shape=(self.n_assets, self.n_layers))
+
+    def layers(self, models=None, return_periods=None, min_band=None):
+        """Boolean mask over layers of the given models and return periods,
+        and bands from `min_band` up (excluding depths outside every band)
+        """
+        mask = np.ones(self.n_layers, dtype=bool)
+        if models is not None:
+            mask &= np.isin(self.models, list(models))
+        if return_periods is not None:
+            mask &= np.isin(self.return_periods, list(return_periods))
+        if min_band is not None:
+            mask &= self.bands >= min_band
+        return mask
+
+    def select(self, models=None, return_periods=None, min_band=None):
+        """Exposure to a subset of layers, e.g. one group of models, with
+        the same assets
+        """
+        mask = self.layers(models, return_periods, min_band)
+        columns = np.flatnonzero(mask)
+        # renumber kept columns, dropping entries of the others
+        new_column = np.full(self.n_layers, -1, dtype=np.int64)
+        new_column[columns] = np.arange(len(columns))
+        keep = mask[self.indices]
+        rows = np.repeat(np.arange(self.n_assets), np.diff(self.indptr))
+        indptr = np.zeros(self.n_assets + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows[keep], minlength=self.n_assets), out=indptr[1:])
+        return ExposureMatrix(
+            indptr, new_column[self.indices[keep]], self.sectors, self.ids,
+            self.models[columns], self.return_periods[columns], self.bands[columns],
+            self.bounds)
+
+    def frequency(self, models=None, return_periods=None, min_band=None):
+        """Number of layers each asset is exposed to
+        """
+        return np.diff(self.select(models, return_periods, min_band).indptr)
+
+    def exposed(self, models=None, return_periods=None, min_band=None):
+        """Boolean mask over assets exposed to any of the layers
+
+        Masks for different models combine as sets, e.g. assets exposed
+        under current but not future climate are
+        ``exposed(current) & ~exposed(future)``.
+        """
+        return self.frequency(models, return_periods, min_band) > 0
+
+    def min_return_period(self, models=None, min_band=None):
+        """Minimum return period at which each asset is exposed, or 0 where
+        it is not exposed to any of the layers
+        """
+        selected = self.select(models, None, min_band)
+        rps = np.zeros(self.n_assets, dtype=np.int64)
+        if len(selected.indices):
+            counts = np.diff(selected.indptr)
+            rows = counts > 0
+            rps[rows] = np.minimum.reduceat(
+                selected.return_periods[selected.indices].astype(np.int64),
+                selected.indptr[:-1][rows])
+        return rps
+
+    def asset_rows(self, sector):
+        """Row of each asset id in a sector, as a dict of id => row
+        """
+        rows = np.flatnonzero(self.sectors == sector)
+        return dict(zip(self.ids[rows].tolist(), rows.tolist()))
+
+
+def write_exposure(exposure, path):
+    """Write an exposure table to Parquet, one row group per model
+
+    Rows are written model by model, in order of each model's first
+    appearance, and keep their original order within each model; rows of
+    different models are not interleaved as in the input.
+
+    Parameters
+    ----------
+    exposure : pandas.DataFrame
+        with at least `EXPOSURE_COLUMNS`; other columns are written as
+        categories
+    path : str
+        Parquet file to write, replaced once complete
+    """
+    exposure = exposure_dtypes(exposure)
+    schema = pa.Schema.from_pandas(exposure, preserve_index=False)
+
+    tmp_path = path + '.tmp'
+    with pq.ParquetWriter(tmp_path, schema) as writer:
+        # models in order of first appearance, rows in their original order
+        # within each model
+        for _, rows in exposure.groupby('model', observed=True, sort=False):
+            writer.write_table(
+                pa.Table.from_pandas(rows, schema=schema, preserve_index=False))
+    os.replace(tmp_path, path)
+
+
+def read_exposure(path, columns=None, models=None, sectors=None):
+    """Read an exposure table written by `write_exposure`
+
+    Parameters
+    ----------
+    path : str
+    columns : list of str, optional
+        columns to read, defaults to all
+    models : list of str, optional
+        models to read, defaults to all; row groups of other models are
+        skipped
+    sectors : list of str, optional
+        sectors to read, defaults to all
+
+    Returns
+    -------
+    pandas.DataFrame
+    """
+    filters = []
+    if models is not None:
+        filters.append(('model', 'in', list(models)))
+    if sectors is not None:
+        filters.append(('sector', 'in', list(sectors)))
+    table = pq.read_table(path, columns=columns, filters=filters or None)
+    exposure = table.to_pandas()
+    # drop categories of models and sectors filtered out
+    for column, dtype in exposure.dtypes.items():
+        if isinstance(dtype, pd.CategoricalDtype):
+            exposure[column] = exposure[column].cat.remove_unused_categories()
+    return exposure
+
+
+def exposure_matrix(exposure, bounds):
+    """Summarise an exposure table as an `ExposureMatrix`
+
+    Parameters
+    ----------
+    exposure : pandas.DataFrame
+        with columns sector, id, model, return_period and flood_depth
+    bounds : list of tuple
+        contiguous (lower, upper) flood depth bands
+
+    Returns
+    -------
+    ExposureMatrix
+        with assets in order of first appearance
+    """
+    bounds = np.array(bounds, dtype=np.float64).reshape(-1, 2)
+    sectors = exposure['sector'].astype(str).values
+    ids = exposure['id'].astype(str).values
+    bands = depth_bands(exposure['flood_depth'].values, bounds)
+
+    assets = pd.DataFrame({'sector': sectors, 'id': ids})
+    asset_codes = assets.groupby(['sector', 'id'], sort=False).ngroup().values
+    first_rows = np.flatnonzero(~assets.duplicated().values)
+
+    layers = pd.DataFrame({
+        'model': exposure['model'].astype(str).values,
+        'return_period': exposure['return_period'].values.astype(np.int16),
+        'band': bands
+    })
+    layer_codes = layers.groupby(['model', 'return_period', 'band'], sort=True).ngroup().values
+    layer_labels = layers.drop_duplicates().sort_values(['model', 'return_period', 'band'])
+
+    matrix = csr_matrix(
+        (np.ones(len(asset_codes), dtype=bool), (asset_codes, layer_codes)),
+        shape=(len(first_rows), len(layer_labels)))
+    matrix.sum_duplicates()
+    matrix.sort_indices()
+
+    return ExposureMatrix(
+        matrix.indptr.astype(np.int64),
+        matrix.indices.astype(np.int64),
+        sectors[first_rows].astype('U'),
+        ids[first_rows].astype('U'),
+        layer_labels['model'].values.astype('U'),
+        layer_labels['return_period'].values,
+        layer_labels['band'].values,
+        bounds)
+
+
+def depth_bands(depths, bounds):
+    """Index of the band each depth falls in, with lower < depth <= upper,
+    or -1 if none
+    """
+    # bounds are contiguous, so their edges are each lower then the last upper
+    edges = np.append(bounds[:, 0], bounds[-1, 1])
+    bands = np.digitize(depths, edges, right=True) - 1
+    bands[(bands < 0) | (bands >= len(bounds))] = -1
+    return bands.astype(np.int8)
+
+
+def save_exposure_matrix(exposure, path):
+    """Save an `ExposureMatrix` as a directory of .npy files, replacing any
+    saved before
+    """
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    save_arrays({key: getattr(exposure, key) for key in EXPOSURE_MATRIX_ARRAYS}, path)
+
+
+def load_exposure_matrix(path, mmap_mode='r'):
+    """Load an `ExposureMatrix` saved by `save_exposure_matrix`
+    """
+    return ExposureMatrix(**load_arrays(path, mmap_mode=mmap_mode))
+
+
+def exposure_dtypes(exposure):
+    """Cast exposure columns to their stored types
+
+    Returns
+    -------
+    pandas.DataFrame
+        a copy, with id as int64 if every id is an integer (otherwise a
+        category), return_period as int16, flood_depth as float32 and
+        every other column as a category
+    """
+    exposure = exposure.reset_index(drop=True)
+    for column in exposure.columns:
+        if column == 'id':
+            exposure[column] = _id_dtype(exposure[column])
+        elif column == 'return_period':
+            exposure[column] = exposure[column].astype(np.int16)
+        elif column == 'flood_depth':
+            exposure[column] = exposure[column].astype(np.float32)
+        elif not isinstance(exposure[column].dtype, pd.CategoricalDtype):
+            exposure[column] = exposure[column].astype('category')
+    return exposure
+
+
+def _id_dtype(ids):
+    """Integer ids where every id is integral, categories otherwise
+    """
+    if pd.api.types.is_integer_dtype(ids.dtype):
+        return ids.astype(np.int64)
+    numeric = pd.to_numeric(ids, errors='coerce')
+    if not numeric.isnull().any() and (numeric == np.floor(numeric)).all():
+        return numeric.astype(np.int64)
+    return ids.astype(str).astype('category')
@@ -0,0 +1,142 @@
+"""Weighted flow map layers
+
+Flow maps draw each link of a network buffered to a width that depends on
+the range its flow value falls in. `FlowLayer` holds the link geometries of
+one dataset with the values of the columns mapped as arrays, assigns links
+to ranges with `np.digitize` and buffers the links of each range in one
+call (vectorised where shapely 2 is available). Buffered geometries are
+kept per width on the layer, so every map drawn from the same dataset
+reuses them, whatever its ranges.
+"""
+from collections import OrderedDict
+
+import numpy as np
+
+try:
+    # shapely 2 buffers arrays of geometries in one call
+    from shapely import buffer as _buffer_array
+except ImportError:
+    _buffer_array = None
+
+
+class FlowLayer(object):
+    """Link geometries of one flow dataset, with values to map
+
+    Attributes
+    ----------
+    geometries : list
+        shapely geometry of each link
+    values : dict
+        column name => numpy.ndarray of float64 value of each link, NaN
+        where missing
+    """
+    def __init__(self, geometries, values):
+        self.geometries = geometries
+        self.values = values
+        # width => buffered geometry of each link, or None until needed
+        self._buffered = {}
+
+    def __len__(self):
+        return len(self.geometries)
+
+    def min(self, column):
+        return np.nanmin(self.values[column])
+
+    def max(self, column):
+        return np.nanmax(self.values[column])
+
+    def abs_max(self, column):
+        return np.nanmax(np.abs(self.values[column]))
+
+    def bins(self, column, ranges):
+        """Index of the range each link value falls in, with
+        nmin <= value < nmax, or -1 if none
+
+        Parameters
+        ----------
+        column : str
+        ranges : list of tuple
+            (nmin, nmax) ranges, not overlapping; empty or inverted ranges
+            (nmin >= nmax) match nothing
+        """
+        mins = np.array([nmin for nmin, _ in ranges], dtype=np.float64)
+        maxs = np.array([nmax for _, nmax in ranges], dtype=np.float64)
+        # candidate ranges, those which can hold a value, in order of nmin
+        order = np.flatnonzero(mins < maxs)
+        order = order[np.argsort(mins[order], kind='stable')]
+        values = self.values[column]
+        # range with the greatest nmin <= value, then check value < nmax
+        bins = np.digitize(values, mins[order]) - 1
+        valid = bins >= 0
+        bins[valid] = order[bins[valid]]
+        valid[valid] = values[valid] < maxs[bins[valid]]
+        bins[~valid] = -1
+        return bins
+
+    def buffered(self, rows, width):
+        """Link geometries buffered by width, for the given rows
+        """
+        cache = self._buffered.setdefault(width, [None] * len(self.geometries))
+        missing = [row for row in rows if cache[row] is None]
+        if missing:
+            geoms = buffer_geometries([self.geometries[row] for row in missing], width)
+            for row, geom in zip(missing, geoms):
+                cache[row] = geom
+        return [cache[row] for row in rows]
+
+    def buffered_by_range(self, column, width_by_range):
+        """Buffered link geometries in each range of column values
+
+        Parameters
+        ----------
+        column : str
+        width_by_range : collections.OrderedDict
+            (nmin, nmax) => buffer width
+
+        Returns
+        -------
+        collections.OrderedDict
+            (nmin, nmax) => list of geometries buffered by the range width
+        """
+        ranges = list(width_by_range)
+        bins = self.bins(column, ranges)
+        geoms_by_range = OrderedDict()
+        for i, range_ in enumerate(ranges):
+            rows = np.flatnonzero(bins == i).tolist()
+            geoms_by_range[range_] = self.buffered(rows, width_by_range[range_])
+        return geoms_by_range
+
+
+def flow_layer(records, columns):
+    """Read a `FlowLayer` from shapefile records
+
+    Parameters
+    ----------
+    records : iterable of cartopy.io.shapereader.Record
+    columns : list of str
+        attributes to read as values, NaN where a record has none (as in
+        datasets which are not mapped by every column)
+    """
+    geometries = []
+    values = {column: [] for column in columns}
+    for record in records:
+        geometries.append(record.geometry)
+        for column in columns:
+            values[column].append(record.attributes.get(column))
+    return FlowLayer(
+        geometries,
+        {
+            column: np.array(
+                [np.nan if value is None else value for value in column_values],
+                dtype=np.float64)
+            for column, column_values in values.items()
+        })
+
+
+def buffer_geometries(geoms, width):
+    """Buffer a list of geometries by the same width
+    """
+    if _buffer_array is not None:
+        # same resolution as geom.buffer, where the array function defaults to 8
+        return list(_buffer_array(geoms, width, quad_segs=16))
+    return [geom.buffer(width) for geom in geoms]
@@ -0,0 +1,237 @@
+"""Geodesic distances and line lengths, vectorised over NumPy arrays
+
+`geocalc` is the great-circle (haversine) distance on a sphere, used for
+network edge lengths and routing bounds. `vincenty_distance` is Vincenty's
+inverse formula on an ellipsoid, as implemented by
+``geopy.distance.vincenty``, iterated for whole arrays of point pairs at
+once.
+
+`great_circle_lengths` and `line_lengths` measure many lines in one call,
+from a flat coordinate buffer with part offsets (the same layout as
+`scripts.network.CompiledNetwork` edge geometries): segment lengths are
+computed for the whole buffer at once and each line's length is the
+difference of two prefix sums. `geometry_lengths` does the same for
+shapely geometries.
+"""
+import numpy as np
+
+EARTH_R = 6372.8
+
+# (semi-major axis km, semi-minor axis km, flattening), as in geopy
+ELLIPSOIDS = {
+    'WGS-84': (6378.137, 6356.7523142, 1 / 298.257223563),
+    'GRS-80': (6378.137, 6356.7523141, 1 / 298.257222101),
+    'Airy (1830)': (6377.563396, 6356.256909, 1 / 299.3249646),
+    'Intl 1924': (6378.388, 6356.911946, 1 / 297.0),
+    'Clarke (1880)': (6378.249145, 6356.51486955, 1 / 293.465),
+    'GRS-67': (6378.1600, 6356.774719, 1 / 298.25),
+}
+
+
+def geocalc(lat0, lon0, lat1, lon1):
+    """Return the distance (in km) between two points in
+    geographical coordinates."""
+    lat0 = np.radians(lat0)
+    lon0 = np.radians(lon0)
+    lat1 = np.radians(lat1)
+    lon1 = np.radians(lon1)
+    dlon = lon0 - lon1
+    y = np.sqrt(
+        (np.cos(lat1) * np.sin(dlon)) ** 2
+        + (np.cos(lat0) * np.sin(lat1)
+           - np.sin(lat0) * np.cos(lat1) * np.cos(dlon)) ** 2)
+    x = np.sin(lat0) * np.sin(lat1) + \
+        np.cos(lat0) * np.cos(lat1) * np.cos(dlon)
+    c = np.arctan2(y, x)
+    return EARTH_R * c
+
+
+def get_path_length(path):
+    """Length (in km) of an array of (x, y) i.e. (lon, lat) point coordinates
+    """
+    return np.sum(geocalc(path[1:, 1], path[1:, 0],
+                          path[:-1, 1], path[:-1, 0]))
+
+
+def vincenty_distance(lon0, lat0, lon1, lat1, ellipsoid='WGS-84', iterations=20):
+    """Distance (in metres) between points in geographical coordinates, on
+    an ellipsoid
+
+    Parameters
+    ----------
+    lon0, lat0, lon1, lat1 : array-like
+        coordinates in degrees
+    ellipsoid : str
+        name of an ellipsoid in `ELLIPSOIDS`
+    iterations : int
+        iteration limit, as in geopy
+
+    Returns
+    -------
+    numpy.ndarray
+        distance in metres between each pair of points
+
+    Raises
+    ------
+    ValueError
+        if the formula fails to converge (for nearly antipodal points)
+    """
+    major, minor, f = ELLIPSOIDS[ellipsoid]
+    lon0, lat0, lon1, lat1 = np.broadcast_arrays(
+        *[np.radians(np.asarray(a, dtype=np.float64)) for a in (lon0, lat0, lon1, lat1)])
+
+    delta_lon = lon1 - lon0
+    reduced_lat0 = np.arctan((1 - f) * np.tan(lat0))
+    reduced_lat1 = np.arctan((1 - f) * np.tan(lat1))
+    sin_reduced0, cos_reduced0 = np.sin(reduced_lat0), np.cos(reduced_lat0)
+    sin_reduced1, cos_reduced1 = np.sin(reduced_lat1), np.cos(reduced_lat1)
+
+    lambda_lon = delta_lon.copy()
+    active = np.ones(lambda_lon.shape, dtype=bool)
+    for _ in range(iterations + 1):
+        sin_lambda, cos_lambda = np.sin(lambda_lon), np.cos(lambda_lon)
+        sin_sigma = np.sqrt(
+            (cos_reduced1 * sin_lambda) ** 2
+            + (cos_reduced0 * sin_reduced1 - sin_reduced0 * cos_reduced1 * cos_lambda) ** 2)
+        # coincident points have zero distance
+        coincident = sin_sigma == 0
+        safe_sin_sigma = np.where(coincident, 1, sin_sigma)
+        cos_sigma = sin_reduced0 * sin_reduced1 + cos_reduced0 * cos_reduced1 * cos_lambda
+        sigma = np.arctan2(sin_sigma, cos_sigma)
+        sin_alpha = cos_reduced0 * cos_reduced1 * sin_lambda / safe_sin_sigma
+        cos_sq_alpha = 1 - sin_alpha ** 2
+        # equatorial lines have cos_sq_alpha == 0
+        cos2_sigma_m = np.where(
+            cos_sq_alpha != 0,
+            cos_sigma - 2 * sin_reduced0 * sin_reduced1 / np.where(cos_sq_alpha != 0, cos_sq_alpha, 1),
+            0.0)
+        c = f / 16. * cos_sq_alpha * (4 + f * (4 - 3 * cos_sq_alpha))
+        lambda_prev = lambda_lon
+        lambda_next = delta_lon + (1 - c) * f * sin_alpha * (
+            sigma + c * sin_sigma * (cos2_sigma_m + c * cos_sigma * (-1 + 2 * cos2_sigma_m ** 2)))
+        lambda_lon = np.where(active, lambda_next, lambda_prev)
+        active &= ~coincident & (np.abs(lambda_lon - lambda_prev) > 10e-12)
+        if not active.any():
+            break
+    else:
+        raise ValueError("Vincenty formula failed to converge!")
+
+    u_sq = cos_sq_alpha * (major ** 2 - minor ** 2) / minor ** 2
+    a = 1 + u_sq / 16384. * (4096 + u_sq * (-768 + u_sq * (320 - 175 * u_sq)))
+    b = u_sq / 1024. * (256 + u_sq * (-128 + u_sq * (74 - 47 * u_sq)))
+    delta_sigma = b * sin_sigma * (
+        cos2_sigma_m + b / 4. * (
+            cos_sigma * (-1 + 2 * cos2_sigma_m ** 2)
+            - b / 6. * cos2_sigma_m * (-3 + 4 * sin_sigma ** 2) * (-3 + 4 * cos2_sigma_m ** 2)))
+    distance = minor * a * (sigma - delta_sigma) * 1000
+    return np.where(coincident, 0.0, distance)
+
+
+def great_circle_lengths(coords, offsets):
+    """Great-circle lengths (in km) of many lines in geographical
+    coordinates, as `get_path_length` for each line
+
+    Parameters
+    ----------
+    coords : numpy.ndarray
+        (n_coords, 2) coordinates of all lines, as (x, y) i.e. (lon, lat)
+    offsets : numpy.ndarray
+        (n_lines + 1) start of each line in `coords`
+
+    Returns
+    -------
+    numpy.ndarray
+        length of each line
+    """
+    coords = np.asarray(coords, dtype=np.float64)
+    if len(coords) < 2:
+        return np.zeros(len(offsets) - 1)
+    segments = geocalc(coords[1:, 1], coords[1:, 0], coords[:-1, 1], coords[:-1, 0])
+    return _part_sums(segments, offsets)
+
+
+def line_lengths(coords, offsets, ellipsoid='WGS-84'):
+    """Lengths (in metres) of many lines in geographical coordinates, on an
+    ellipsoid
+
+    Parameters
+    ----------
+    coords : numpy.ndarray
+        (n_coords, 2) coordinates of all lines, as (x, y) i.e. (lon, lat)
+    offsets : numpy.ndarray
+        (n_lines + 1) start of each line in `coords`
+    ellipsoid : str
+        name of an ellipsoid in `ELLIPSOIDS`
+
+    Returns
+    -------
+    numpy.ndarray
+        length of each line
+    """
+    coords = np.asarray(coords, dtype=np.float64)
+    if len(coords) < 2:
+        return np.zeros(len(offsets) - 1)
+    segments = vincenty_distance(
+        coords[:-1, 0], coords[:-1, 1], coords[1:, 0], coords[1:, 1], ellipsoid)
+    return _part_sums(segments, offsets)
+
+
+def _part_sums(segments, offsets):
+    """Sum segment values over each part of a coordinate buffer
+
+    Segments joining the end of one part to the start of the next fall
+    outside every part's range, so drop out of the differences.
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    cumulative = np.zeros(len(segments) + 1)
+    np.cumsum(segments, out=cumulative[1:])
+    starts = offsets[:-1]
+    ends = np.maximum(offsets[1:] - 1, starts)
+    return cumulative[ends] - cumulative[starts]
+
+
+def geometry_coords(geometries):
+    """Flatten LineStrings and MultiLineStrings into a coordinate buffer
+
+    Returns
+    -------
+    tuple(numpy.ndarray, numpy.ndarray, numpy.ndarray)
+        (n_coords, 2) coordinates, (n_parts + 1) part offsets into them and
+        the index of the geometry each part belongs to
+    """
+    parts = []
+    part_geometries = []
+    for i, geometry in enumerate(geometries):
+        if geometry is None or geometry.is_empty:
+            continue
+        if geometry.geom_type == 'MultiLineString':
+            lines = geometry.geoms
+        else:
+            lines = [geometry]
+        for line in lines:
+            parts.append(np.asarray(line.coords, dtype=np.float64)[:, :2])
+            part_geometries.append(i)
+
+    offsets = np.zeros(len(parts) + 1, dtype=np.int64)
+    np.cumsum([len(part) for part in parts], out=offsets[1:])
+    if parts:
+        coords = np.concatenate(parts)
+    else:
+        coords = np.zeros((0, 2))
+    return coords, offsets, np.array(part_geometries, dtype=np.int64)
+
+
+def geometry_lengths(geometries, ellipsoid='WGS-84'):
+    """Lengths (in metres) of LineStrings or MultiLineStrings in
+    geographical coordinates, e.g. a GeoSeries
+
+    Returns
+    -------
+    numpy.ndarray
+        length of each geometry, 0 for empty geometries
+    """
+    geometries = list(geometries)
+    coords, offsets, part_geometries = geometry_coords(geometries)
+    return np.bincount(
+        part_geometries, weights=line_lengths(coords, offsets, ellipsoid),
+        minlength=len(geometries))
@@ -0,0 +1,138 @@
+"""Intersect networks with hazard rasters over a process pool
+
+The work is split into partitions of (network chunk, hazard layer), each
+a range of up to `chunk_size` features of one network file intersected
+with one hazard raster. Each partition's rows are written to their own
+file in a partition directory as it completes, so an interrupted run
+resumes by skipping partitions already written. Each network chunk is
+rasterised once per distinct hazard grid before any partition runs, and
+the partitions then read its pixels from the cache. Once all partitions are
+done they are merged, in network, hazard, feature order (the same order
+as intersecting serially), into one exposure table, which stores them
+grouped by model (see `scripts.exposure`).
+"""
+import itertools
+import os
+import shutil
+from multiprocessing import Pool
+
+import fiona
+import pandas as pd
+
+from scripts.exposure import EXPOSURE_COLUMNS, write_exposure
+from scripts.raster import raster_grid, read_feature_pixels, zonal_max
+
+
+def intersect_networks(network_details, hazard_details, output_path,
+                       chunk_size=20000, processes=None, partition_dir=None):
+    """Write the maximum hazard value over each network element, for every
+    hazard layer, where it is greater than 0 (and less than 999)
+
+    Parameters
+    ----------
+    network_details : list of dict
+        with keys 'sector', 'node_or_edge', 'path', 'id_key' and optionally
+        'properties', a list of (column, property) pairs to add to each row
+    hazard_details : list of dict
+        with keys 'path', 'model' and 'r_period'
+    output_path : str
+        Parquet exposure table to write
+    chunk_size : int
+        number of network features in each partition
+    processes : int, optional
+        number of worker processes, defaults to the number of CPUs
+    partition_dir : str, optional
+        directory for partial results, defaults to output_path + '.parts';
+        removed once the output is written
+    """
+    if partition_dir is None:
+        partition_dir = output_path + '.parts'
+    os.makedirs(partition_dir, exist_ok=True)
+
+    partitions = []
+    for i, network in enumerate(network_details):
+        with fiona.open(network['path']) as features:
+            n_features = len(features)
+        for j, hazard in enumerate(hazard_details):
+            for k, start in enumerate(range(0, n_features, chunk_size)):
+                partition_path = os.path.join(partition_dir, '{}_{}_{}.parquet'.format(i, j, k))
+                partitions.append(
+                    (partition_path, network, hazard, start, start + chunk_size))
+
+    todo = [partition for partition in partitions if not os.path.exists(partition[0])]
+    print("{} of {} partitions to run".format(len(todo), len(partitions)))
+
+    # rasterise each network chunk once per hazard grid before intersecting,
+    # so that no two workers build (and race to cache) the same pixels
+    grids = {}
+    pixel_tasks = {}
+    for _, network, hazard, start, stop in todo:
+        if hazard['path'] not in grids:
+            grids[hazard['path']] = raster_grid(hazard['path'])
+        key = (network['path'], start, stop, grids[hazard['path']])
+        pixel_tasks.setdefault(key, (network['path'], hazard['path'], start, stop))
+
+    with Pool(processes) as pool:
+        for _ in pool.imap_unordered(cache_partition_pixels, pixel_tasks.values()):
+            pass
+        for n, partition_path in enumerate(pool.imap_unordered(intersect_partition, todo)):
+            print("{}/{} {}".format(n + 1, len(todo), os.path.basename(partition_path)))
+
+    exposure = pd.concat(
+        [pd.read_parquet(partition[0]) for partition in sorted(partitions, key=_merge_order)],
+        ignore_index=True, sort=False)
+    write_exposure(exposure, output_path)
+    shutil.rmtree(partition_dir)
+
+
+def cache_partition_pixels(task):
+    """Rasterise one network chunk on one hazard grid, caching its pixels
+    for the partitions on that grid
+    """
+    vector_path, raster_path, start, stop = task
+    read_feature_pixels(vector_path, raster_path, start=start, stop=stop)
+
+
+def intersect_partition(partition):
+    """Intersect one network chunk with one hazard layer, writing exposed
+    elements to the partition's file, and return its path
+    """
+    partition_path, network, hazard, start, stop = partition
+    properties = network.get('properties', [])
+
+    pixels = read_feature_pixels(network['path'], hazard['path'], start=start, stop=stop)
+    all_max = zonal_max(hazard['path'], pixels)
+
+    exposed = (all_max > 0) & (all_max < 999)
+    ids = []
+    values = {column: [] for column, _ in properties}
+    with fiona.open(network['path']) as features:
+        elements = itertools.islice(features, start, stop)
+        for element in itertools.compress(elements, exposed.tolist()):
+            ids.append(element['properties'][network['id_key']])
+            for column, key in properties:
+                values[column].append(element['properties'][key])
+
+    exposure = pd.DataFrame({
+        'network_element': network['node_or_edge'],
+        'sector': network['sector'],
+        'id': pd.Series(ids, dtype=object),
+        'model': hazard['model'],
+        'return_period': int(hazard['r_period']),
+        'flood_depth': all_max[exposed].astype('float32')
+    }, columns=EXPOSURE_COLUMNS)
+    for column, _ in properties:
+        exposure[column] = pd.Series(values[column], dtype=object)
+
+    # only complete partitions are skipped on resume
+    tmp_path = partition_path + '.tmp'
+    exposure.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, partition_path)
+    return partition_path
+
+
+def _merge_order(partition):
+    """Sort partitions by network, hazard, then chunk
+    """
+    i, j, k = os.path.splitext(os.path.basename(partition[0]))[0].split('_')
+    return int(i), int(j), int(k)
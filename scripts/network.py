@@ -0,0 +1,622 @@
+"""Compiled networks for routing
+
+A networkx graph read with ``nx.read_shp`` keeps a dict of attributes (and
+a GeoJSON string) for every edge, which makes routing and geometry lookups
+slow and memory hungry. `compile_network` converts such a graph once into
+flat NumPy arrays:
+
+- compressed sparse row (CSR) adjacency: `offsets`, `neighbours` and
+  `adj_edges`, with every undirected edge stored once from each end
+- per-edge `lengths` (km) and `times` (hours)
+- one flat coordinate buffer `coords` with per-edge `coord_offsets` for
+  edge geometry, each running from the edge's first to its second node, so
+  a route's geometry is a gather over index ranges (`route_coords`)
+
+Nodes are numbered 0..n_nodes-1 and edges 0..n_edges-1.
+
+`read_network` caches compiled networks on disk as .npy arrays, keyed by
+the source shapefile contents, and memory-maps them on later runs.
+"""
+import hashlib
+import heapq
+import json
+import os
+
+import networkx as nx
+import numpy as np
+from scipy.spatial import cKDTree
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+
+from scripts.cache import load_arrays, save_arrays, update_shapefile_hash
+from scripts.geodesic import EARTH_R, great_circle_lengths
+
+# Bump when the compiled layout changes, to invalidate cached networks
+NETWORK_CACHE_VERSION = 3
+NETWORK_ARRAYS = (
+    'node_coords', 'edge_nodes', 'lengths', 'times', 'coords', 'coord_offsets',
+    'offsets', 'neighbours', 'adj_edges'
+)
+
+
+class CompiledNetwork(object):
+    """Undirected network stored as flat arrays
+
+    Attributes
+    ----------
+    node_coords : numpy.ndarray
+        (n_nodes, 2) node coordinates, as (x, y) i.e. (lon, lat)
+    edge_nodes : numpy.ndarray
+        (n_edges, 2) node ids at each end of each edge
+    lengths : numpy.ndarray
+        edge lengths in km
+    times : numpy.ndarray
+        edge travel times in hours (nan where speed is unknown)
+    coords : numpy.ndarray
+        (n_coords, 2) coordinates of all edge geometries, edge by edge, each
+        running from edge_nodes[edge, 0] to edge_nodes[edge, 1]
+    coord_offsets : numpy.ndarray
+        (n_edges + 1) start of each edge's geometry in `coords`
+    attributes : dict
+        attribute name => numpy.ndarray of per-edge values
+    offsets : numpy.ndarray
+        (n_nodes + 1) start of each node's entries in `neighbours`
+    neighbours : numpy.ndarray
+        (2 * n_edges) node at the far end of each adjacency entry
+    adj_edges : numpy.ndarray
+        (2 * n_edges) edge id of each adjacency entry
+    """
+    def __init__(self, node_coords, edge_nodes, lengths, times, coords,
+                 coord_offsets, attributes=None, adjacency=None):
+        self.node_coords = node_coords
+        self.edge_nodes = edge_nodes
+        self.lengths = lengths
+        self.times = times
+        self.coords = coords
+        self.coord_offsets = coord_offsets
+        if attributes is None:
+            attributes = {}
+        self.attributes = attributes
+        if adjacency is None:
+            adjacency = build_adjacency(len(node_coords), edge_nodes)
+        self.offsets, self.neighbours, self.adj_edges = adjacency
+        self._node_lookup = None
+        self._snapper = None
+        self._adjacency_matrices = {}
+
+    @property
+    def n_nodes(self):
+        return len(self.node_coords)
+
+    @property
+    def n_edges(self):
+        return len(self.edge_nodes)
+
+    def weights(self, weight='distance'):
+        """Per-edge weights: 'distance' (km), 't_time' (hours) or the name of
+        a numeric edge attribute
+        """
+        if weight == 'distance':
+            return self.lengths
+        if weight == 't_time':
+            return self.times
+        return self.attributes[weight]
+
+    def adjacency(self, weight='distance', edge_mask=None):
+        """Weighted adjacency as a scipy.sparse matrix, for use with
+        scipy.sparse.csgraph
+
+        The matrix shares its index arrays with the network, unless
+        edge_mask (a boolean array over edge ids) is given to leave out
+        edges where it is False.
+        """
+        if edge_mask is not None:
+            keep = edge_mask[self.adj_edges]
+            kept = np.zeros(len(keep) + 1, dtype=np.int64)
+            np.cumsum(keep, out=kept[1:])
+            data = self.weights(weight)[self.adj_edges[keep]]
+            return csr_matrix(
+                (data, self.neighbours[keep], kept[self.offsets]),
+                shape=(self.n_nodes, self.n_nodes))
+
+        if weight not in self._adjacency_matrices:
+            data = self.weights(weight)[self.adj_edges]
+            self._adjacency_matrices[weight] = csr_matrix(
+                (data, self.neighbours, self.offsets),
+                shape=(self.n_nodes, self.n_nodes))
+        return self._adjacency_matrices[weight]
+
+    def node_index(self, node):
+        """Look up node id from an (x, y) tuple as used for networkx nodes
+        """
+        if self._node_lookup is None:
+            self._node_lookup = {
+                tuple(xy): i for i, xy in enumerate(self.node_coords.tolist())
+            }
+        return self._node_lookup[tuple(node)]
+
+    def snap(self, xs, ys):
+        """Snap arrays of points to their closest nodes
+
+        Returns
+        -------
+        tuple(numpy.ndarray, numpy.ndarray)
+            node ids and great-circle snap distances in km
+        """
+        if self._snapper is None:
+            self._snapper = NodeSnapper(self.node_coords)
+        return self._snapper.snap(xs, ys)
+
+    def nearest_node(self, x, y):
+        """Id of the node closest to (x, y)
+        """
+        node_ids, _ = self.snap([x], [y])
+        return int(node_ids[0])
+
+    def edge_between(self, n0, n1, weight='distance'):
+        """Id of the lowest weight edge joining node ids n0 and n1
+        """
+        start, end = self.offsets[n0], self.offsets[n0 + 1]
+        candidates = self.adj_edges[start:end][self.neighbours[start:end] == n1]
+        if not len(candidates):
+            raise KeyError("No edge between nodes {} and {}".format(n0, n1))
+        return int(candidates[np.argmin(self.weights(weight)[candidates])])
+
+    def path_edges(self, path, weight='distance'):
+        """Edge ids along a path given as a sequence of node ids
+        """
+        return np.array([
+            self.edge_between(path[i], path[i + 1], weight)
+            for i in range(len(path) - 1)
+        ], dtype=np.int64)
+
+    def edge_coords(self, edge):
+        """Array of point coordinates along an edge
+        """
+        return self.coords[self.coord_offsets[edge]:self.coord_offsets[edge + 1]]
+
+    def route_coords(self, edges, source):
+        """Coordinates along a route, given as edge ids in order from node
+        source, as one (n, 2) array
+
+        Edges are traversed forward or reversed as the route requires, and
+        the shared point where consecutive edges meet is kept once.
+        """
+        edges = np.asarray(edges, dtype=np.int64)
+        if not len(edges):
+            return self.node_coords[[source]]
+        ends = self.edge_nodes[edges]
+
+        # the node each edge is entered from: source, then the node shared
+        # with the previous edge
+        entry = np.empty(len(edges), dtype=np.int64)
+        entry[0] = source
+        if len(edges) > 1:
+            shared_end = (ends[:-1, 1] == ends[1:, 0]) | (ends[:-1, 1] == ends[1:, 1])
+            entry[1:] = np.where(shared_end, ends[:-1, 1], ends[:-1, 0])
+        reverse = ends[:, 0] != entry
+
+        starts = self.coord_offsets[edges]
+        counts = self.coord_offsets[edges + 1] - starts
+        position = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        index = np.repeat(starts, counts) + np.where(
+            np.repeat(reverse, counts), np.repeat(counts - 1, counts) - position, position)
+        keep = position > 0
+        keep[0] = True
+        return self.coords[index[keep]]
+
+    def path_coords(self, path, weight='distance'):
+        """Coordinates along a path given as a list of node ids
+        """
+        return self.route_coords(self.path_edges(path, weight), path[0])
+
+
+class NodeSnapper(object):
+    """Nearest-node lookup for arrays of points
+
+    Builds a KD-tree once over node positions as unit vectors on the sphere,
+    so that the nearest node in straight-line (chord) distance is also the
+    nearest by great-circle distance, with no distortion away from the
+    equator.
+    """
+    def __init__(self, node_coords):
+        node_coords = np.asarray(node_coords, dtype=np.float64).reshape(-1, 2)
+        self.tree = cKDTree(unit_vectors(node_coords[:, 0], node_coords[:, 1]))
+
+    def snap(self, xs, ys):
+        """Snap points given as arrays of x (lon) and y (lat)
+
+        Returns
+        -------
+        tuple(numpy.ndarray, numpy.ndarray)
+            index of the closest node for each point and great-circle distance
+            to it in km
+        """
+        chords, node_ids = self.tree.query(unit_vectors(xs, ys))
+        distances = 2 * EARTH_R * np.arcsin(np.minimum(chords / 2, 1))
+        return node_ids, distances
+
+
+def unit_vectors(xs, ys):
+    """(n, 3) array of unit vectors for arrays of lon, lat in degrees
+    """
+    lon = np.radians(np.asarray(xs, dtype=np.float64))
+    lat = np.radians(np.asarray(ys, dtype=np.float64))
+    cos_lat = np.cos(lat)
+    return np.column_stack([cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)])
+
+
+def build_adjacency(n_nodes, edge_nodes):
+    """Build CSR offsets, neighbours and edge ids from (n_edges, 2) edge ends
+    """
+    n_edges = len(edge_nodes)
+    sources = np.concatenate([edge_nodes[:, 0], edge_nodes[:, 1]])
+    targets = np.concatenate([edge_nodes[:, 1], edge_nodes[:, 0]])
+    edge_ids = np.concatenate([np.arange(n_edges), np.arange(n_edges)])
+
+    order = np.argsort(sources, kind='mergesort')
+    offsets = np.zeros(n_nodes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources, minlength=n_nodes), out=offsets[1:])
+    return offsets, targets[order].astype(np.int32), edge_ids[order].astype(np.int32)
+
+
+def compile_network(graph, speeds=None, speed_attr='highway',
+                    attributes=('osm_id', 'name', 'highway')):
+    """Compile a networkx graph (as read by ``nx.read_shp``) to arrays
+
+    Each edge geometry is parsed from its 'Json' attribute exactly once,
+    oriented from the edge's first to its second node, and edge lengths are
+    computed for all edges at once from the combined coordinates.
+
+    Parameters
+    ----------
+    graph : networkx.Graph
+        undirected graph with (x, y) tuple nodes
+    speeds : dict, optional
+        `speed_attr` value => speed in km/h; if not given, each edge's
+        'speed' attribute is used where present
+    speed_attr : str
+        edge attribute to look up in `speeds`
+    attributes : tuple of str
+        edge attributes to keep, where present in the graph
+
+    Returns
+    -------
+    CompiledNetwork
+    """
+    node_coords = np.array(list(graph.nodes()), dtype=np.float64).reshape(-1, 2)
+    node_lookup = {node: i for i, node in enumerate(graph.nodes())}
+
+    edge_nodes = []
+    speed_values = []
+    coord_parts = []
+    kept = {key: [] for key in attributes}
+    for n0, n1, data in graph.edges(data=True):
+        if n0 == n1:
+            continue
+        path = np.array(json.loads(data['Json'])['coordinates'], dtype=np.float64)
+        # orient geometry from n0 to n1
+        if np.sum((path[0] - n0) ** 2) > np.sum((path[0] - n1) ** 2):
+            path = path[::-1]
+        edge_nodes.append((node_lookup[n0], node_lookup[n1]))
+        coord_parts.append(path)
+
+        if speeds is not None:
+            speed_values.append(speeds.get(data.get(speed_attr), np.nan))
+        else:
+            speed_values.append(data.get('speed', np.nan))
+
+        for key in attributes:
+            kept[key].append(data.get(key))
+
+    coord_offsets = np.zeros(len(coord_parts) + 1, dtype=np.int64)
+    np.cumsum([len(part) for part in coord_parts], out=coord_offsets[1:])
+    if coord_parts:
+        coords = np.vstack(coord_parts)
+    else:
+        coords = np.zeros((0, 2))
+    lengths = great_circle_lengths(coords, coord_offsets)
+    times = lengths / np.array(speed_values, dtype=np.float64)
+
+    edge_attributes = {}
+    for key, values in kept.items():
+        if any(value is not None for value in values):
+            values = np.array(['' if value is None else value for value in values])
+            if values.dtype == object:
+                values = values.astype(str)
+            edge_attributes[key] = values
+
+    return CompiledNetwork(
+        node_coords,
+        np.array(edge_nodes, dtype=np.int64).reshape(-1, 2),
+        lengths,
+        times,
+        coords,
+        coord_offsets,
+        edge_attributes
+    )
+
+
+def read_network(path, speeds=None, speed_attr='highway',
+                 attributes=('osm_id', 'name', 'highway'), cache_dir=None):
+    """Read the largest connected component of a network shapefile as a
+    CompiledNetwork, using an on-disk cache where possible
+
+    The cache is keyed by a hash of the shapefile contents and the
+    compilation options (including the speed table), so a changed input is
+    compiled afresh and an unchanged one is loaded memory-mapped, without
+    recomputing any geometry lengths.
+
+    Parameters
+    ----------
+    path : str
+        line shapefile, as read by ``nx.read_shp``
+    cache_dir : str, optional
+        defaults to a '.network_cache' directory next to the shapefile
+
+    Other parameters are passed to `compile_network`.
+    """
+    cache_path = network_cache_path(path, speeds, speed_attr, attributes, cache_dir)
+    if os.path.exists(cache_path):
+        return load_network(cache_path)
+
+    g = nx.read_shp(path)
+    sg = max(nx.connected_component_subgraphs(g.to_undirected()), key=len)
+    net = compile_network(sg, speeds, speed_attr, attributes)
+    save_network(net, cache_path)
+    return net
+
+
+def network_cache_path(path, speeds=None, speed_attr='highway',
+                       attributes=('osm_id', 'name', 'highway'), cache_dir=None):
+    """Directory where `read_network` caches a compiled network
+    """
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(path)), '.network_cache')
+    return os.path.join(
+        cache_dir, network_cache_key(path, speeds, speed_attr, attributes))
+
+
+def network_cache_key(path, speeds=None, speed_attr='highway', attributes=()):
+    """Hash of shapefile contents and compilation options
+    """
+    sha = hashlib.sha1()
+    sha.update(str(NETWORK_CACHE_VERSION).encode('utf-8'))
+    update_shapefile_hash(sha, path)
+    if speeds is not None:
+        speeds = sorted((str(key), float(value)) for key, value in speeds.items())
+    sha.update(json.dumps([speeds, speed_attr, list(attributes)]).encode('utf-8'))
+    return sha.hexdigest()
+
+
+def save_network(net, cache_path):
+    """Save a CompiledNetwork as a directory of .npy files
+    """
+    arrays = {'attr_' + key: values for key, values in net.attributes.items()}
+    for key in NETWORK_ARRAYS:
+        arrays[key] = getattr(net, key)
+    save_arrays(arrays, cache_path)
+
+
+def load_network(cache_path, mmap_mode='r'):
+    """Load a CompiledNetwork saved by `save_network`
+
+    Arrays are memory-mapped (read-only) by default, so loading is near
+    instant and processes reading the same cache share its pages.
+    """
+    arrays = load_arrays(cache_path, mmap_mode)
+    attributes = {
+        key[5:]: values for key, values in arrays.items() if key.startswith('attr_')
+    }
+    return CompiledNetwork(
+        arrays['node_coords'],
+        arrays['edge_nodes'],
+        arrays['lengths'],
+        arrays['times'],
+        arrays['coords'],
+        arrays['coord_offsets'],
+        attributes,
+        (arrays['offsets'], arrays['neighbours'], arrays['adj_edges'])
+    )
+
+
+def shortest_path(net, source, target, weight='distance'):
+    """Shortest path between node ids, by Dijkstra's algorithm on the
+    compiled arrays, stopping as soon as the target is settled
+
+    Returns
+    -------
+    tuple(float, list)
+        path weight and list of node ids from source to target, or
+        (inf, []) if target is unreachable
+    """
+    return shortest_paths_to_targets(net, source, [target], weight)[target]
+
+
+def shortest_paths_to_targets(net, source, targets, weight='distance'):
+    """Shortest paths from one source node to many targets, from a single
+    Dijkstra search which stops once every target is settled
+
+    Returns
+    -------
+    dict
+        target node id => tuple(path weight, list of node ids), with
+        (inf, []) for unreachable targets
+    """
+    dist, pred = _dijkstra(net, source, targets, weight)
+    paths = {}
+    for target in targets:
+        if np.isfinite(dist[target]):
+            paths[target] = (dist[target], _trace(pred, target))
+        else:
+            paths[target] = (np.inf, [])
+    return paths
+
+
+def multi_source_distances(net, sources, weight='distance', edge_mask=None):
+    """Distance from every node to its closest source node, by a single
+    Dijkstra search seeded from all the sources at once
+
+    Parameters
+    ----------
+    sources : array-like
+        source node ids
+    edge_mask : numpy.ndarray, optional
+        boolean array over edge ids, False for edges to leave out
+
+    Returns
+    -------
+    tuple(numpy.ndarray, numpy.ndarray)
+        per-node distance to the closest source (inf where unreachable) and
+        id of that source node (-1 where unreachable)
+    """
+    sources = np.unique(sources)
+    if not len(sources):
+        return np.full(net.n_nodes, np.inf), np.full(net.n_nodes, -1, dtype=np.int64)
+
+    dist, _, closest = dijkstra(
+        net.adjacency(weight, edge_mask), directed=True, indices=sources,
+        min_only=True, return_predecessors=True)
+    closest = closest.astype(np.int64)
+    closest[closest < 0] = -1
+    return dist, closest
+
+
+def shortest_path_tree(net, source, weight='distance', edge_mask=None):
+    """Shortest path tree from source, by a single Dijkstra search
+
+    Parameters
+    ----------
+    edge_mask : numpy.ndarray, optional
+        boolean array over edge ids, False for edges to leave out
+
+    Returns
+    -------
+    tuple(numpy.ndarray, numpy.ndarray, numpy.ndarray)
+        per-node distance from source (inf where unreachable), predecessor
+        node and edge id used to reach each node from its predecessor (both
+        -1 for source and unreachable nodes)
+    """
+    dist, pred = dijkstra(
+        net.adjacency(weight, edge_mask), directed=True, indices=source,
+        return_predecessors=True)
+    pred = pred.astype(np.int64)
+    pred[pred < 0] = -1
+
+    # pick the lowest weight edge from each node to its predecessor
+    owners = np.repeat(np.arange(net.n_nodes), np.diff(net.offsets))
+    entries = np.flatnonzero(pred[owners] == net.neighbours)
+    if edge_mask is not None:
+        entries = entries[edge_mask[net.adj_edges[entries]]]
+    edges = net.adj_edges[entries]
+    entries = entries[np.lexsort((net.weights(weight)[edges], owners[entries]))]
+    nodes, first = np.unique(owners[entries], return_index=True)
+    pred_edge = np.full(net.n_nodes, -1, dtype=np.int64)
+    pred_edge[nodes] = net.adj_edges[entries[first]]
+    return dist, pred, pred_edge
+
+
+def bridges_and_components(net, edge_mask=None):
+    """Bridges and connected components, by a single depth-first search
+
+    Parameters
+    ----------
+    edge_mask : numpy.ndarray, optional
+        boolean array over edge ids, False for edges to leave out
+
+    Returns
+    -------
+    tuple(numpy.ndarray, numpy.ndarray)
+        boolean array over edge ids, True for bridges, i.e. edges which
+        disconnect their ends when removed (never true of parallel edges),
+        and per-node connected component label
+    """
+    offsets = net.offsets.tolist()
+    neighbours = net.neighbours.tolist()
+    adj_edges = net.adj_edges.tolist()
+    if edge_mask is None:
+        usable = [True] * net.n_edges
+    else:
+        usable = np.asarray(edge_mask, dtype=bool).tolist()
+
+    order = [-1] * net.n_nodes
+    low = [0] * net.n_nodes
+    component = np.full(net.n_nodes, -1, dtype=np.int64)
+    bridges = np.zeros(net.n_edges, dtype=bool)
+    count = 0
+    for root in range(net.n_nodes):
+        if order[root] >= 0:
+            continue
+        order[root] = low[root] = count
+        count += 1
+        component[root] = root
+        # (node, edge id it was reached by, next adjacency entry to visit)
+        stack = [[root, -1, offsets[root]]]
+        while stack:
+            top = stack[-1]
+            node, in_edge, entry = top
+            if entry < offsets[node + 1]:
+                top[2] += 1
+                edge = adj_edges[entry]
+                # skip the edge id reached by, so parallel edges count as cycles
+                if edge == in_edge or not usable[edge]:
+                    continue
+                nbr = neighbours[entry]
+                if order[nbr] < 0:
+                    order[nbr] = low[nbr] = count
+                    count += 1
+                    component[nbr] = root
+                    stack.append([nbr, edge, offsets[nbr]])
+                else:
+                    low[node] = min(low[node], order[nbr])
+            else:
+                stack.pop()
+                if stack:
+                    parent = stack[-1][0]
+                    low[parent] = min(low[parent], low[node])
+                    if low[node] > order[parent]:
+                        bridges[in_edge] = True
+    return bridges, component
+
+
+def _dijkstra(net, source, targets, weight):
+    """Dijkstra search from source until all targets are settled, returning
+    distance and predecessor arrays
+    """
+    edge_weights = net.weights(weight)
+    offsets = net.offsets
+    neighbours = net.neighbours
+    adj_edges = net.adj_edges
+
+    remaining = set(targets)
+    dist = np.full(net.n_nodes, np.inf)
+    pred = np.full(net.n_nodes, -1, dtype=np.int64)
+    settled = np.zeros(net.n_nodes, dtype=bool)
+    dist[source] = 0
+    heap = [(0.0, source)]
+    while heap and remaining:
+        d, node = heapq.heappop(heap)
+        if settled[node]:
+            continue
+        settled[node] = True
+        remaining.discard(node)
+
+        start, end = offsets[node], offsets[node + 1]
+        nbrs = neighbours[start:end]
+        new_dist = d + edge_weights[adj_edges[start:end]]
+        better = new_dist < dist[nbrs]
+        for nbr, nbr_dist in zip(nbrs[better].tolist(), new_dist[better].tolist()):
+            if nbr_dist < dist[nbr]:
+                dist[nbr] = nbr_dist
+                pred[nbr] = node
+                heapq.heappush(heap, (nbr_dist, nbr))
+
+    return dist, pred
+
+
+def _trace(pred, node):
+    path = [node]
+    while pred[node] != -1:
+        node = int(pred[node])
+        path.append(node)
+    return path[::-1]
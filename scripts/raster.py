@@ -0,0 +1,517 @@
+"""Shared raster processing functions
+
+`read_feature_pixels` and `zonal_max` split zonal statistics over many
+rasters on the same grid into two steps: each vector feature is rasterised
+once to the (row, col) indices of the pixels it covers, which are cached on
+disk, then the maximum value per feature is a gather over those indices,
+reading each raster in blocks of rows.
+
+`threshold_levels` and `threshold_shapes` polygonise a raster at many
+thresholds from a single read.
+
+`read_overview` serves hazard rasters for drawing from a pyramid of
+overviews, each half the resolution of the last, decimated by taking the
+maximum (so no flooded cell disappears at coarse levels). The pyramid is
+built once per raster, cached on disk and memory-mapped, and only the
+level and window matching the drawn extent and resolution are read.
+
+`read_histograms` counts raster values into fixed bins, reading each raster
+block by block over a process pool and caching the counts beside it.
+"""
+import hashlib
+import itertools
+import json
+import os
+from multiprocessing import Pool
+
+import fiona
+import numpy as np
+import rasterio
+import rasterio.features
+import rasterio.mask
+import rasterio.warp
+
+from affine import Affine
+from rasterio.enums import Resampling
+from rasterio.vrt import WarpedVRT
+from rasterio.windows import Window
+from shapely.geometry import mapping, shape
+
+from scripts.cache import load_arrays, save_arrays, update_shapefile_hash
+
+# Bump when feature pixel layout changes, to invalidate cached pixels
+PIXEL_CACHE_VERSION = 1
+PIXEL_ARRAYS = ('offsets', 'rows', 'cols')
+# Bump when the pyramid layout changes, to invalidate cached overviews
+PYRAMID_CACHE_VERSION = 1
+# Bump when histogram counting changes, to invalidate cached histograms
+HISTOGRAM_CACHE_VERSION = 1
+
+
+def raster_points(raster_path, geometry, threshold=None, resolution=None, skip=1):
+    """Read the cells of a raster within a geometry as arrays of points
+
+    Only the window covering the geometry is read, and cells are kept if
+    their centre falls inside it, as with ``gdalwarp -cutline``.
+
+    Parameters
+    ----------
+    raster_path : str
+        single band raster in geographic coordinates
+    geometry : shapely.geometry
+        area of interest, in EPSG:4326
+    threshold : float, optional
+        keep only cells with value greater than threshold
+    resolution : float, optional
+        resample to this cell size in degrees (by averaging) before reading,
+        as with ``gdalwarp -tr <res> <res> -r average``
+    skip : int
+        keep every nth row and column, as with ``gdal2xyz.py -skip``
+
+    Returns
+    -------
+    tuple(numpy.ndarray, numpy.ndarray, numpy.ndarray)
+        x, y of cell centres and cell values
+    """
+    with rasterio.open(raster_path) as src:
+        if resolution is None:
+            data, transform = rasterio.mask.mask(
+                src, [mapping(geometry)], crop=True, filled=False)
+        else:
+            dst_transform, width, height = rasterio.warp.calculate_default_transform(
+                src.crs, 'EPSG:4326', src.width, src.height, *src.bounds,
+                resolution=resolution)
+            with WarpedVRT(src, crs='EPSG:4326', transform=dst_transform,
+                           width=width, height=height,
+                           resampling=Resampling.average) as vrt:
+                data, transform = rasterio.mask.mask(
+                    vrt, [mapping(geometry)], crop=True, filled=False)
+
+    data = data[0]
+    keep = ~np.ma.getmaskarray(data)
+    if skip > 1:
+        keep[np.arange(keep.shape[0]) % skip != 0, :] = False
+        keep[:, np.arange(keep.shape[1]) % skip != 0] = False
+    if threshold is not None:
+        keep &= data.filled(threshold) > threshold
+
+    rows, cols = np.nonzero(keep)
+    xs, ys = transform * (cols + 0.5, rows + 0.5)
+    return xs, ys, np.asarray(data[rows, cols])
+
+
+def feature_pixels(geometries, transform, shape_, all_touched=False):
+    """Pixels of a raster grid covered by each geometry
+
+    Each geometry is rasterised within its own bounding window, as
+    ``rasterstats.zonal_stats`` does, and pixels outside the grid are
+    dropped.
+
+    Parameters
+    ----------
+    geometries : iterable
+        shapely geometries (or None) in the raster's coordinate system
+    transform : affine.Affine
+        raster grid transform
+    shape_ : tuple(int, int)
+        raster grid (height, width)
+    all_touched : bool
+        include all pixels touched by geometries, rather than those whose
+        centre is inside polygons or on the path of lines
+
+    Returns
+    -------
+    tuple(numpy.ndarray, numpy.ndarray, numpy.ndarray)
+        (n_features + 1) offsets of each feature's pixels, and row and
+        column indices of the pixels, feature by feature
+    """
+    height, width = shape_
+    inverse = ~transform
+    counts = []
+    rows = []
+    cols = []
+    for geometry in geometries:
+        if geometry is None or geometry.is_empty:
+            counts.append(0)
+            continue
+        minx, miny, maxx, maxy = geometry.bounds
+        corners_c, corners_r = inverse * (np.array([minx, maxx]), np.array([maxy, miny]))
+        col0 = max(int(np.floor(corners_c.min())), 0)
+        col1 = min(int(np.floor(corners_c.max())) + 1, width)
+        row0 = max(int(np.floor(corners_r.min())), 0)
+        row1 = min(int(np.floor(corners_r.max())) + 1, height)
+        if col0 >= col1 or row0 >= row1:
+            counts.append(0)
+            continue
+
+        burned = rasterio.features.rasterize(
+            [(geometry, 1)], out_shape=(row1 - row0, col1 - col0),
+            transform=transform * Affine.translation(col0, row0),
+            all_touched=all_touched, dtype=np.uint8)
+        feature_rows, feature_cols = np.nonzero(burned)
+        counts.append(len(feature_rows))
+        rows.append(feature_rows + row0)
+        cols.append(feature_cols + col0)
+
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    if rows:
+        rows = np.concatenate(rows).astype(np.int32)
+        cols = np.concatenate(cols).astype(np.int32)
+    else:
+        rows = np.zeros(0, dtype=np.int32)
+        cols = np.zeros(0, dtype=np.int32)
+    return offsets, rows, cols
+
+
+def raster_grid(raster_path):
+    """Transform and shape of a raster's grid, as a hashable key of which
+    rasters share pixels
+    """
+    with rasterio.open(raster_path) as src:
+        return tuple(src.transform)[:6], tuple(src.shape)
+
+
+def read_feature_pixels(vector_path, raster_path, all_touched=False, cache_dir=None,
+                        start=0, stop=None):
+    """Pixels of raster_path's grid covered by each feature of vector_path,
+    as for `feature_pixels`, in the order fiona reads the features
+
+    Results are cached in cache_dir (by default ``.pixel_cache`` beside the
+    vector file), keyed by the vector file contents and the raster grid, so
+    rasters on the same grid share them.
+
+    start and stop select a range of features, as for a slice.
+    """
+    transform, shape_ = raster_grid(raster_path)
+
+    sha = hashlib.sha1()
+    sha.update(str(PIXEL_CACHE_VERSION).encode('utf-8'))
+    update_shapefile_hash(sha, vector_path)
+    sha.update(json.dumps(
+        [list(transform), list(shape_), all_touched, start, stop]).encode('utf-8'))
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(vector_path)), '.pixel_cache')
+    cache_path = os.path.join(cache_dir, sha.hexdigest())
+
+    if os.path.exists(cache_path):
+        arrays = load_arrays(cache_path)
+        return tuple(arrays[key] for key in PIXEL_ARRAYS)
+
+    with fiona.open(vector_path) as features:
+        geometries = [
+            shape(feature['geometry']) if feature['geometry'] else None
+            for feature in itertools.islice(features, start, stop)
+        ]
+    pixels = feature_pixels(geometries, Affine(*transform), shape_, all_touched)
+    save_arrays(dict(zip(PIXEL_ARRAYS, pixels)), cache_path)
+    return pixels
+
+
+def zonal_max(raster_path, pixels, band=1, block_rows=1024):
+    """Maximum raster value over each feature's pixels
+
+    The raster is read in blocks of rows, each cropped to the columns with
+    pixels in it, so only the parts of the raster under features are read.
+
+    Parameters
+    ----------
+    raster_path : str
+    pixels : tuple(numpy.ndarray, numpy.ndarray, numpy.ndarray)
+        offsets, rows and cols, as returned by `feature_pixels`
+    band : int
+    block_rows : int
+        number of raster rows to read at a time
+
+    Returns
+    -------
+    numpy.ndarray
+        maximum value per feature, nan for features with no pixels or only
+        nodata pixels
+    """
+    offsets, rows, cols = pixels
+    values = np.full(len(rows), np.nan)
+    with rasterio.open(raster_path) as src:
+        nodata = src.nodata
+        order = np.argsort(rows, kind='mergesort')
+        sorted_rows = rows[order]
+        if len(rows):
+            for row0 in range(int(sorted_rows[0]), int(sorted_rows[-1]) + 1, block_rows):
+                i0, i1 = np.searchsorted(sorted_rows, [row0, row0 + block_rows])
+                if i0 == i1:
+                    continue
+                block = order[i0:i1]
+                block_cols = cols[block]
+                col0 = int(block_cols.min())
+                n_rows = min(block_rows, src.height - row0)
+                data = src.read(band, window=Window(
+                    col0, row0, int(block_cols.max()) + 1 - col0, n_rows))
+                values[block] = data[rows[block] - row0, block_cols - col0]
+
+    if nodata is not None:
+        values[values == nodata] = np.nan
+
+    maxima = np.full(len(offsets) - 1, np.nan)
+    has_pixels = np.diff(offsets) > 0
+    if has_pixels.any():
+        with np.errstate(invalid='ignore'):
+            maxima[has_pixels] = np.fmax.reduceat(values, offsets[:-1][has_pixels])
+    return maxima
+
+
+def threshold_levels(raster_path, thresholds, upper=999, band=1):
+    """Read a raster once and count the thresholds each cell reaches
+
+    The cells at or above ``thresholds[i]`` (and below `upper`, and not
+    nodata) are those where ``levels > i``, so a mask for every threshold
+    comes from a single uint8 array. The raster is classified one block at
+    a time, so the only full-size array is the uint8 result.
+
+    Parameters
+    ----------
+    raster_path : str
+    thresholds : list of float
+        in increasing order, at most 255
+    upper : float
+        values at or above this are treated as missing
+    band : int
+
+    Returns
+    -------
+    tuple(numpy.ndarray, affine.Affine, rasterio.crs.CRS)
+        levels, and the raster transform and crs
+    """
+    thresholds = np.asarray(thresholds, dtype=np.float64)
+    with rasterio.open(raster_path) as src:
+        transform = src.transform
+        crs = src.crs
+        levels = np.zeros((src.height, src.width), dtype=np.uint8)
+        for _, window in src.block_windows(band):
+            values = src.read(band, window=window, masked=True).filled(np.nan)
+            rows, cols = window.toslices()
+            block = levels[rows, cols]
+            with np.errstate(invalid='ignore'):
+                # number of thresholds <= value, as np.digitize(values, thresholds)
+                block[...] = np.searchsorted(thresholds, values, side='right')
+                block[~(values < upper)] = 0
+    return levels, transform, crs
+
+
+def threshold_shapes(levels, level, transform):
+    """Polygons of the cells at or above a threshold level, as
+    ``gdal_polygonize.py`` (with 4-connectedness) makes from a 0/1 mask
+
+    Yields
+    ------
+    dict
+        GeoJSON-like polygon geometry
+    """
+    mask = levels > level
+    for geometry, _ in rasterio.features.shapes(
+            mask.view(np.uint8), mask=mask, connectivity=4, transform=transform):
+        yield geometry
+
+
+def read_overview(raster_path, extent=None, resolution=None, cache_dir=None, band=1):
+    """Read a raster for drawing, at the coarsest overview with cells no
+    larger than resolution, cropped to extent
+
+    Values below 0 are read as 0. Overviews are built and cached on the
+    first call for each raster (by default in ``.pyramid_cache`` beside
+    it), keyed by the raster path, size and modification time.
+
+    Parameters
+    ----------
+    raster_path : str
+    extent : tuple, optional
+        (xmin, xmax, ymin, ymax) area to read, defaults to the whole raster
+    resolution : float, optional
+        cell size in raster units (e.g. degrees per pixel drawn), defaults
+        to full resolution
+
+    Returns
+    -------
+    tuple(numpy.ndarray, tuple)
+        data, and its (xmin, xmax, ymin, ymax) extent
+    """
+    with rasterio.open(raster_path) as src:
+        transform = src.transform
+        height, width = src.shape
+
+    factor = 1
+    if resolution is not None:
+        # largest power of two with cells no larger than resolution
+        max_factor = max(height, width)
+        while factor * 2 * abs(transform.a) <= resolution and factor * 2 <= max_factor:
+            factor *= 2
+
+    if factor == 1:
+        window = _extent_window(extent, transform, height, width)
+        with rasterio.open(raster_path) as src:
+            data = src.read(band, window=window)
+        data[data < 0] = 0
+        return data, _window_extent(window, transform)
+
+    levels = read_pyramid(raster_path, cache_dir, band)
+    level = min(int(np.log2(factor)), len(levels))
+    data = levels[level - 1]
+    level_transform = transform * Affine.scale(2 ** level)
+    window = _extent_window(extent, level_transform, *data.shape)
+    return (
+        data[window.row_off:window.row_off + window.height,
+             window.col_off:window.col_off + window.width],
+        _window_extent(window, level_transform))
+
+
+def _raster_cache_path(raster_path, cache_name, cache_dir, *key):
+    """Cache path for results derived from a raster, keyed by its path,
+    size and modification time (and any further key values), by default in
+    a directory named cache_name beside it
+    """
+    stat = os.stat(raster_path)
+    sha = hashlib.sha1()
+    sha.update(json.dumps(
+        [os.path.abspath(raster_path), stat.st_size, stat.st_mtime] + list(key)).encode('utf-8'))
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(raster_path)), cache_name)
+    return os.path.join(cache_dir, sha.hexdigest())
+
+
+def read_pyramid(raster_path, cache_dir=None, band=1):
+    """Overviews of a raster, memory-mapped from the cache, building and
+    caching them first if needed
+
+    Returns
+    -------
+    list of numpy.ndarray
+        levels 1, 2, ... at 1/2, 1/4, ... resolution, down to a few hundred
+        cells across
+    """
+    cache_path = _raster_cache_path(
+        raster_path, '.pyramid_cache', cache_dir, PYRAMID_CACHE_VERSION, band)
+
+    if not os.path.exists(cache_path):
+        levels = build_pyramid(raster_path, band)
+        save_arrays(
+            {'level_{}'.format(i + 1): level for i, level in enumerate(levels)}, cache_path)
+
+    arrays = load_arrays(cache_path)
+    return [arrays['level_{}'.format(i + 1)] for i in range(len(arrays))]
+
+
+def build_pyramid(raster_path, band=1, min_size=256, block_rows=1024):
+    """Max-decimated overviews of a raster, with values below 0 read as 0
+
+    The first level is built reading the raster in blocks of rows (an even
+    number, so blocks decimate independently), each written into place, so
+    the full resolution raster is never held in memory. Edges are padded
+    with 0 to an even number of cells.
+    """
+    block_rows += block_rows % 2
+    with rasterio.open(raster_path) as src:
+        height, width = src.shape
+        level = np.empty(((height + 1) // 2, (width + 1) // 2), dtype=np.float32)
+        for row0 in range(0, height, block_rows):
+            data = src.read(band, window=Window(
+                0, row0, width, min(block_rows, height - row0)))
+            block = _decimate_max(np.maximum(data, 0).astype(np.float32))
+            level[row0 // 2:row0 // 2 + len(block)] = block
+    levels = [level]
+    while max(levels[-1].shape) > min_size:
+        levels.append(_decimate_max(levels[-1]))
+    return levels
+
+
+def _decimate_max(data):
+    """Maximum over each 2x2 block of cells, padding with 0
+    """
+    height, width = data.shape
+    padded = np.zeros((height + height % 2, width + width % 2), dtype=data.dtype)
+    padded[:height, :width] = data
+    blocks = padded.reshape(padded.shape[0] // 2, 2, padded.shape[1] // 2, 2)
+    # fmax ignores nan cells within a block
+    return np.fmax.reduce(np.fmax.reduce(blocks, axis=3), axis=1)
+
+
+def _extent_window(extent, transform, height, width):
+    """Window of a grid covering extent (xmin, xmax, ymin, ymax), clipped to
+    the grid, or the whole grid if extent is None
+    """
+    if extent is None:
+        return Window(0, 0, width, height)
+    xmin, xmax, ymin, ymax = extent
+    cols, rows = ~transform * (np.array([xmin, xmax]), np.array([ymax, ymin]))
+    col0 = min(max(int(np.floor(cols.min())), 0), width)
+    col1 = min(max(int(np.ceil(cols.max())), col0), width)
+    row0 = min(max(int(np.floor(rows.min())), 0), height)
+    row1 = min(max(int(np.ceil(rows.max())), row0), height)
+    return Window(col0, row0, col1 - col0, row1 - row0)
+
+
+def _window_extent(window, transform):
+    """(xmin, xmax, ymin, ymax) extent of a window of a grid
+    """
+    x0, y0 = transform * (window.col_off, window.row_off)
+    x1, y1 = transform * (window.col_off + window.width, window.row_off + window.height)
+    return (min(x0, x1), max(x0, x1), min(y0, y1), max(y0, y1))
+
+
+def read_histograms(raster_paths, bins, range_, lower=0, upper=999, band=1,
+                    cache_dir=None, processes=None):
+    """Histograms of the values of many rasters, as from `block_histogram`
+
+    Histograms are cached (by default in ``.histogram_cache`` beside each
+    raster), keyed by the raster path, size and modification time, so only
+    rasters changed since the last run are read, over a process pool.
+
+    Returns
+    -------
+    list of tuple(numpy.ndarray, numpy.ndarray)
+        counts and bin edges of each raster, as from `numpy.histogram`
+    """
+    tasks = [
+        (raster_path, bins, range_, lower, upper, band, _raster_cache_path(
+            raster_path, '.histogram_cache', cache_dir,
+            HISTOGRAM_CACHE_VERSION, bins, list(range_), lower, upper, band))
+        for raster_path in raster_paths
+    ]
+    todo = [task for task in tasks if not os.path.exists(task[-1])]
+    if todo:
+        with Pool(processes) as pool:
+            pool.map(_cache_histogram, todo)
+
+    histograms = []
+    for task in tasks:
+        arrays = load_arrays(task[-1], mmap_mode=None)
+        histograms.append((arrays['counts'], arrays['edges']))
+    return histograms
+
+
+def _cache_histogram(task):
+    """Count and cache one raster's histogram
+    """
+    raster_path, bins, range_, lower, upper, band, cache_path = task
+    counts, edges = block_histogram(raster_path, bins, range_, lower, upper, band)
+    save_arrays({'counts': counts, 'edges': edges}, cache_path)
+
+
+def block_histogram(raster_path, bins, range_, lower=0, upper=999, band=1):
+    """Histogram of the finite values of a raster with lower < value < upper
+
+    The raster is read one block at a time, in the order GDAL stores them,
+    so memory use does not depend on raster size.
+
+    Returns
+    -------
+    tuple(numpy.ndarray, numpy.ndarray)
+        counts and bin edges, as ``numpy.histogram(values, bins, range_)``
+    """
+    counts = np.zeros(bins, dtype=np.int64)
+    edges = np.histogram_bin_edges([], bins, range_)
+    with rasterio.open(raster_path) as src:
+        for _, window in src.block_windows(band):
+            data = src.read(band, window=window)
+            with np.errstate(invalid='ignore'):
+                values = data[np.isfinite(data) & (data > lower) & (data < upper)]
+            counts += np.histogram(values, bins, range_)[0]
+    return counts, edges
@@ -5,10 +5,10 @@ import os
 
 from math import log10, floor
 
-from boltons.iterutils import pairwise
-from geopy.distance import vincenty
 from osgeo import gdal
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 from matplotlib.colors import LogNorm, ListedColormap, BoundaryNorm
+from matplotlib.figure import Figure
 from matplotlib.image import BboxImage
 from matplotlib.legend_handler import HandlerBase
 from matplotlib.transforms import Bbox, TransformedBbox
@@ -17,6 +17,11 @@ import cartopy.crs as ccrs
 import cartopy.io.shapereader as shpreader
 import matplotlib.patches as mpatches
 import matplotlib.pyplot as plt
+import numpy as np
+
+from scripts.basemap import read_basemap
+from scripts.geodesic import geometry_lengths
+from scripts.raster import read_overview
 
 def load_config():
     """Read config.json
@@ -27,9 +32,17 @@ def load_config():
     return config
 
 
-def get_data(filename):
+def get_data(filename, extent=None, resolution=None):
     """Read in data (as array) and extent of each raster
+
+    With extent (x0, x1, y0, y1) and resolution (degrees per pixel, see
+    `get_axes_resolution`), read only the area drawn from a cached overview
+    at about that resolution (see `scripts.raster.read_overview`).
     """
+    if extent is not None or resolution is not None:
+        data, (xmin, xmax, ymin, ymax) = read_overview(filename, extent, resolution)
+        return data, (xmin, xmax, ymax, ymin)
+
     gdal.UseExceptions()
     ds = gdal.Open(filename)
     data = ds.ReadAsArray()
@@ -53,6 +66,14 @@ def get_data(filename):
     return data, lat_lon_extent
 
 
+def get_axes_resolution(ax):
+    """Size in degrees of a pixel of lat-lon axes, as drawn
+    """
+    x0, x1, y0, y1 = ax.get_extent(crs=ccrs.PlateCarree())
+    bbox = ax.get_window_extent()
+    return min((x1 - x0) / bbox.width, (y1 - y0) / bbox.height)
+
+
 def get_tz_axes():
     """Setup plot figure and return Tanzania axes
     """
@@ -100,84 +121,97 @@ def plot_basemap(ax, data_path):
     """Plot countries and regions background
     """
     proj = ccrs.PlateCarree()
+    basemap = read_basemap(data_path)
 
-    states_filename = os.path.join(
-        data_path,
-        'Infrastructure',
-        'Boundaries',
-        'ne_10m_admin_0_countries_lakes.shp'
-    )
+    # Neighbours
+    ax.add_geometries(
+        basemap['neighbours'],
+        crs=proj,
+        edgecolor='white',
+        facecolor='#e0e0e0',
+        zorder=1)
 
-    states_over_lakes_filename = os.path.join(
-        data_path,
-        'Infrastructure',
-        'Boundaries',
-        'ne_10m_admin_0_countries.shp'
-    )
+    # Regions
+    ax.add_geometries(basemap['regions'], crs=proj, edgecolor='#ffffff', facecolor='#d2d2d2')
 
-    provinces_filename = os.path.join(
-        data_path,
-        'Infrastructure',
-        'Boundaries',
-        'ne_10m_admin_1_states_provinces_lakes.shp'
-    )
+    # Lakes
+    ax.add_geometries(
+        basemap['lakes'],
+        crs=proj,
+        edgecolor='none',
+        facecolor='#c6e0ff',
+        zorder=1)
 
-    lakes_filename = os.path.join(
-        data_path,
-        'Infrastructure',
-        'Boundaries',
-        'ne_10m_lakes.shp'
-    )
+    # Tanzania, political border
+    ax.add_geometries(basemap['tanzania'], crs=proj, edgecolor='#a0a0a0', facecolor='none')
 
-    # Neighbours
-    for record in shpreader.Reader(states_filename).records():
-        country_code = record.attributes['ISO_A2']
-        if country_code in ('BI', 'RW', 'CD', 'UG', 'KE', 'ZM', 'MW', 'MZ', 'SO'):
-            geom = record.geometry
-            ax.add_geometries(
-                [geom],
-                crs=proj,
-                edgecolor='white',
-                facecolor='#e0e0e0',
-                zorder=1)
 
-    # Regions
-    for record in shpreader.Reader(provinces_filename).records():
-        country_code = record.attributes['iso_a2']
-        if country_code == 'TZ':
-            geom = record.geometry
-            ax.add_geometries([geom], crs=proj, edgecolor='#ffffff', facecolor='#d2d2d2')
+_basemap_images = {}
 
-    # Lakes
-    for record in shpreader.Reader(lakes_filename).records():
-        name = record.attributes['name']
-        geom = record.geometry
 
-        if name in (
-                'Lake Victoria',
-                'Lake Tanganyika',
-                'Lake Malawi',
-                'Lake Kivu',
-                'Lake Edward',
-                'Lake Rukwa',
-                'Lake Bunyoni',
-                'Lake Natron',
-                'Lake Manyara',
-                'Lake Lembeni',
-                'Lake Eyasi'):
-            ax.add_geometries(
-                [geom],
-                crs=proj,
-                edgecolor='none',
-                facecolor='#c6e0ff',
-                zorder=1)
+def plot_basemap_image(ax, data_path):
+    """Plot countries and regions background from a rendered image
 
-    # Tanzania, political border
-    for record in shpreader.Reader(states_over_lakes_filename).records():
-        country_code = record.attributes['ISO_A2']
-        if country_code == 'TZ':
-            geom = record.geometry
-            ax.add_geometries([geom], crs=proj, edgecolor='#a0a0a0', facecolor='none')
+    Draws the same layers as `plot_basemap`, rendered once per process for
+    each data path, extent, axes size in pixels and background colour, then
+    reused as an image under everything else on the axes. Labels are left to
+    `plot_basemap_labels`, so they stay vector text above thematic layers.
+    """
+    proj = ccrs.PlateCarree()
+    ax.apply_aspect()
+    extent = tuple(round(value, 6) for value in ax.get_extent(crs=proj))
+    bbox = ax.get_window_extent()
+    dpi = ax.figure.dpi
+    facecolor = tuple(ax.background_patch.get_facecolor())
+    width = int(round(bbox.width))
+    height = int(round(bbox.height))
+    key = (data_path, extent, width, height, dpi, facecolor)
+
+    if key not in _basemap_images:
+        _basemap_images[key] = render_basemap(
+            data_path, extent, width, height, dpi, facecolor)
+
+    x0, x1, y0, y1 = extent
+    ax.imshow(
+        _basemap_images[key],
+        origin='upper',
+        extent=(x0, x1, y0, y1),
+        transform=proj,
+        interpolation='none',
+        zorder=0.5)
+    # imshow may autoscale the axes, so restore the extent drawn
+    ax.set_extent(extent, crs=proj)
+
+
+def render_basemap(data_path, extent, width, height, dpi, facecolor='#c6e0ff'):
+    """Render `plot_basemap` offscreen to an RGBA image
+
+    Parameters
+    ----------
+    data_path : str
+    extent : tuple
+        (xmin, xmax, ymin, ymax) in degrees
+    width, height : int
+        image size in pixels
+    dpi : float
+    facecolor : color, optional
+        background colour, defaults to the sea colour set by `set_ax_bg`
+
+    Returns
+    -------
+    numpy.ndarray
+        (height, width, 4) uint8 RGBA
+    """
+    proj = ccrs.PlateCarree()
+    fig = Figure(figsize=(width / dpi, height / dpi), dpi=dpi)
+    canvas = FigureCanvasAgg(fig)
+    ax = fig.add_axes([0, 0, 1, 1], projection=proj)
+    ax.set_extent(extent, crs=proj)
+    ax.outline_patch.set_visible(False)
+    ax.background_patch.set_facecolor(facecolor)
+    plot_basemap(ax, data_path)
+    canvas.draw()
+    return np.asarray(canvas.buffer_rgba()).copy()
 
 
 def plot_basemap_labels(ax, data_path):
@@ -185,20 +219,7 @@ def plot_basemap_labels(ax, data_path):
     """
     proj = ccrs.PlateCarree()
     extent = ax.get_extent()
-
-    provinces_filename = os.path.join(
-        data_path,
-        'Infrastructure',
-        'Boundaries',
-        'ne_10m_admin_1_states_provinces_lakes.shp'
-    )
-
-    lakes_filename = os.path.join(
-        data_path,
-        'Infrastructure',
-        'Boundaries',
-        'ne_10m_lakes.shp'
-    )
+    basemap = read_basemap(data_path)
 
     # Neighbour labels
     neighbours = [
@@ -241,48 +262,36 @@ def plot_basemap_labels(ax, data_path):
         'Zanzibar West'
     ]
 
-    for record in shpreader.Reader(provinces_filename).records():
-        country_code = record.attributes['iso_a2']
-        if country_code == 'TZ':
-            geom = record.geometry
-            centroid = geom.centroid
-            cx = geom.centroid.x
-            cy = geom.centroid.y
-            name = record.attributes['name']
-
-            if name in no_label_regions:
-                continue
+    for name, cx, cy in basemap['regions_labels']:
+        if name in no_label_regions:
+            continue
 
-            if name in nudge_regions:
-                dx, dy = nudge_regions[name]
-                cx += dx
-                cy += dy
+        if name in nudge_regions:
+            dx, dy = nudge_regions[name]
+            cx += dx
+            cy += dy
 
-            if name == 'Dar-Es-Salaam':
-                ha = 'left'
-            else:
-                ha = 'center'
+        if name == 'Dar-Es-Salaam':
+            ha = 'left'
+        else:
+            ha = 'center'
 
-            if within_extent(cx, cy, extent):
-                ax.text(
-                    cx,
-                    cy,
-                    name,
-                    alpha=0.7,
-                    size=8,
-                    horizontalalignment=ha,
-                    transform=proj)
+        if within_extent(cx, cy, extent):
+            ax.text(
+                cx,
+                cy,
+                name,
+                alpha=0.7,
+                size=8,
+                horizontalalignment=ha,
+                transform=proj)
 
     # Lakes
-    for record in shpreader.Reader(lakes_filename).records():
-        name = record.attributes['name']
-        geom = record.geometry
+    for name, cx, cy in basemap['lakes_labels']:
         if name in (
                 'Lake Victoria',
                 'Lake Tanganyika',
                 'Lake Malawi'):
-            cx = geom.centroid.x
-            cy = geom.centroid.y
             # nudge
             if name == 'Lake Victoria':
                 cy -= 0.2
@@ -453,23 +462,16 @@ def plot_regions(ax, data_path):
 def line_length(line, ellipsoid='WGS-84'):
     """Length of a line in meters, given in geographic coordinates
 
-    Adapted from https://gis.stackexchange.com/questions/4022/looking-for-a-pythonic-way-to-calculate-the-length-of-a-wkt-linestring#answer-115285
-
     Args:
-        line: a shapely LineString object with WGS-84 coordinates
-        ellipsoid: string name of an ellipsoid that `geopy` understands (see
-            http://geopy.readthedocs.io/en/latest/#module-geopy.distance)
+        line: a shapely LineString or MultiLineString object with WGS-84
+            coordinates
+        ellipsoid: string name of an ellipsoid in `scripts.geodesic.ELLIPSOIDS`
+            (the same names as `geopy`)
 
     Returns:
         Length of line in meters
     """
-    if line.geometryType() == 'MultiLineString':
-        return sum(line_length(segment) for segment in line)
-
-    return sum(
-        vincenty(a, b, ellipsoid=ellipsoid).meters
-        for a, b in pairwise(line.coords)
-    )
+    return geometry_lengths([line], ellipsoid)[0]
 
 
 class HandlerImage(HandlerBase):
@@ -0,0 +1,47 @@
+"""Small random networks for tests
+"""
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from scripts.network import CompiledNetwork
+
+
+def random_multigraph(n_nodes, n_edges, seed):
+    """CompiledNetwork on random edges, with some node pairs joined by
+    several edges of different lengths
+    """
+    rng = np.random.RandomState(seed)
+    edge_nodes = rng.randint(0, n_nodes, (n_edges, 2))
+    edge_nodes = edge_nodes[edge_nodes[:, 0] != edge_nodes[:, 1]]
+    edge_nodes = np.vstack([edge_nodes, edge_nodes[:n_edges // 4]])
+    lengths = rng.random_sample(len(edge_nodes)) + 0.01
+    coords = np.zeros((2 * len(edge_nodes), 2))
+    coord_offsets = np.arange(0, 2 * len(edge_nodes) + 1, 2)
+    return CompiledNetwork(
+        rng.random_sample((n_nodes, 2)), edge_nodes, lengths, lengths.copy(),
+        coords, coord_offsets)
+
+
+def simple_adjacency(net):
+    """Adjacency keeping the shortest of any parallel edges, where
+    csr_matrix would sum them
+    """
+    rows = np.concatenate([net.edge_nodes[:, 0], net.edge_nodes[:, 1]])
+    cols = np.concatenate([net.edge_nodes[:, 1], net.edge_nodes[:, 0]])
+    data = np.concatenate([net.lengths, net.lengths])
+    order = np.lexsort((data, cols, rows))
+    rows, cols, data = rows[order], cols[order], data[order]
+    first = np.ones(len(rows), dtype=bool)
+    first[1:] = (rows[1:] != rows[:-1]) | (cols[1:] != cols[:-1])
+    return csr_matrix(
+        (data[first], (rows[first], cols[first])), shape=(net.n_nodes, net.n_nodes))
+
+
+def path_length(net, path):
+    """Length of a node path, over the shortest edge between each node pair
+    """
+    lengths = {}
+    for (n0, n1), length in zip(net.edge_nodes.tolist(), net.lengths.tolist()):
+        for key in ((n0, n1), (n1, n0)):
+            lengths[key] = min(length, lengths.get(key, np.inf))
+    return sum(lengths[key] for key in zip(path[:-1], path[1:]))
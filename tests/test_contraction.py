@@ -0,0 +1,55 @@
+"""Contraction hierarchy queries and flow assignment against
+scipy.sparse.csgraph
+"""
+import numpy as np
+from scipy.sparse.csgraph import dijkstra
+
+from networks import path_length, random_multigraph, simple_adjacency
+from scripts.contraction import assign_flows, build_hierarchy
+
+
+def test_hierarchy_path():
+    for seed in range(5):
+        net = random_multigraph(60, 90, seed)
+        hierarchy = build_hierarchy(net)
+        expected = dijkstra(simple_adjacency(net), directed=True)
+        for source in range(0, net.n_nodes, 7):
+            for target in range(net.n_nodes):
+                dist, path = hierarchy.path(source, target)
+                if np.isinf(expected[source, target]):
+                    assert np.isinf(dist)
+                    assert path == []
+                    continue
+                assert np.isclose(dist, expected[source, target])
+                assert path[0] == source and path[-1] == target
+                assert np.isclose(path_length(net, path), dist)
+
+                edges = hierarchy.path_edges(source, target)
+                assert np.isclose(net.lengths[edges].sum(), dist)
+
+
+def test_assign_flows():
+    for seed in range(5):
+        net = random_multigraph(60, 90, seed)
+        hierarchy = build_hierarchy(net)
+        expected = dijkstra(simple_adjacency(net), directed=True)
+
+        rng = np.random.RandomState(seed)
+        origins = rng.randint(0, net.n_nodes, 200)
+        destinations = rng.randint(0, net.n_nodes, 200)
+        flows = rng.random_sample(200)
+        edge_flows, od_dist = assign_flows(
+            hierarchy, origins, destinations, flows, net.n_edges)
+
+        assert np.allclose(od_dist, expected[origins, destinations])
+        # flow on each edge is that of the OD paths through it
+        reachable = np.isfinite(od_dist)
+        assert np.isclose(
+            np.sum(edge_flows * net.lengths),
+            np.sum(flows[reachable] * od_dist[reachable]))
+        path_flows = np.zeros(net.n_edges)
+        for origin, destination, flow in zip(origins, destinations, flows):
+            edges = hierarchy.path_edges(origin, destination)
+            if edges is not None:
+                path_flows[edges] += flow
+        assert np.allclose(edge_flows, path_flows)
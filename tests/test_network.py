@@ -0,0 +1,22 @@
+"""Compiled network searches against scipy.sparse.csgraph
+"""
+import numpy as np
+from scipy.sparse.csgraph import dijkstra
+
+from networks import path_length, random_multigraph, simple_adjacency
+from scripts.network import shortest_path
+
+
+def test_shortest_path_multigraph():
+    for seed in range(10):
+        net = random_multigraph(60, 90, seed)
+        expected = dijkstra(simple_adjacency(net), directed=True, indices=0)
+        for target in range(net.n_nodes):
+            dist, path = shortest_path(net, 0, target)
+            if np.isinf(expected[target]):
+                assert np.isinf(dist)
+                assert path == []
+                continue
+            assert np.isclose(dist, expected[target])
+            assert path[0] == 0 and path[-1] == target
+            assert np.isclose(path_length(net, path), dist)